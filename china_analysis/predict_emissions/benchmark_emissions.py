@@ -0,0 +1,188 @@
+"""
+Stage by stage benchmark of the emissions pipeline on synthetic data (see synthetic_data.py)
+
+Times ingest, combine, training, prediction and reporting, records the peak RSS of every stage
+(this process plus its worker processes) and saves the results as JSON so runs can be compared.
+
+Usage: python benchmark_emissions.py --eia-plants 5000 --plants 20000 --years 2013-2023 --workers 4
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+from datetime import datetime
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from synthetic_data import make_eia_workbooks, make_power_plants, make_country_tables, country_names, parse_years
+from ingest_functions import load_emissions
+from combine_functions import combine_emissions
+from model_functions import prepare_training_data, train_models
+from predict_functions import stream_predictions, PredictionCache
+from report_functions import load_comparison, country_year_aggregates, render_reports
+from storage_functions import create_sqlite_engine, create_indexes
+
+
+def current_rss():
+    """Resident memory in bytes of this process and its children"""
+    if psutil is not None:
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return rss
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class PeakRSS:
+    """Samples RSS on a background thread while a stage runs"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.start = current_rss()
+        self.peak = self.start
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def run_stage(results, name, func, *args, **kwargs):
+    """Run one stage, print and record its wall time and peak RSS"""
+    with PeakRSS() as memory:
+        start = time.perf_counter()
+        output = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+    results.append({
+        'stage': name,
+        'seconds': round(seconds, 3),
+        'rss_start_mb': round(memory.start / 2**20, 1),
+        'peak_rss_mb': round(memory.peak / 2**20, 1),
+    })
+    print(f"{name:<16} {seconds:>9.2f} s   peak RSS {memory.peak / 2**20:>8.1f} MB")
+    return output
+
+
+def prepare_data(data_dir, args, countries):
+    """Generate the synthetic workbooks once, later runs with the same data_dir reuse them"""
+    eia_dir = os.path.join(data_dir, 'eia')
+    years = parse_years(args.years)
+    files = [f'emissions{year}.xlsx' for year in years]
+    if not all(os.path.exists(os.path.join(eia_dir, f)) for f in files):
+        print(f"Generating {len(files)} synthetic EIA workbooks in {eia_dir} ...")
+        make_eia_workbooks(eia_dir, years, args.eia_plants, args.seed)
+    return eia_dir, files
+
+
+def load_plant_tables(engine, args, countries):
+    """power_plant, carbon_accounting and nox_sulfur tables (setup, not timed)"""
+    plants = make_power_plants(args.plants, countries, args.seed)
+    plants['Technology'] = plants['Technology'].str.lower()
+    plants['id'] = plants.index + 1
+    carbon, nox_sulfur = make_country_tables(countries, seed=args.seed)
+    plants.to_sql('power_plant', con=engine, if_exists='replace', index=False)
+    carbon.to_sql('carbon_accounting', con=engine, if_exists='replace', index=False)
+    nox_sulfur.to_sql('nox_sulfur', con=engine, if_exists='replace', index=False)
+    create_indexes(engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the emissions pipeline stage by stage on synthetic data")
+    parser.add_argument('--eia-plants', type=int, default=5000, help="plants in every synthetic EIA workbook")
+    parser.add_argument('--plants', type=int, default=20000, help="synthetic Chinese power plants")
+    parser.add_argument('--countries', type=int, default=40)
+    parser.add_argument('--years', default='2013-2023', help="EIA workbook years")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="processes for ingest and reporting")
+    parser.add_argument('--train-mode', default='separate', choices=['separate', 'multioutput'])
+    parser.add_argument('--chunk-rows', type=int, default=500_000, help="plant-year rows per prediction chunk")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', default=None, help="keep the synthetic workbooks here between runs")
+    parser.add_argument('--out', default='benchmarks', help="directory for the JSON results")
+    args = parser.parse_args()
+
+    countries = country_names(args.countries)
+    work_dir = tempfile.mkdtemp(prefix='emissions_bench_')
+    data_dir = args.data_dir or os.path.join(work_dir, 'data')
+    results = []
+    try:
+        eia_dir, files = prepare_data(data_dir, args, countries)
+        cache_dir = os.path.join(work_dir, 'eia_cache')
+        engine = create_sqlite_engine(os.path.join(work_dir, 'power_plant_data.db'))
+        load_plant_tables(engine, args, countries)
+
+        pollutant_dfs = run_stage(results, 'ingest', load_emissions, eia_dir, files, cache_dir=cache_dir, workers=args.workers)
+        run_stage(results, 'ingest (cached)', load_emissions, eia_dir, files, cache_dir=cache_dir, workers=args.workers)
+        final_df = run_stage(results, 'combine', combine_emissions, pollutant_dfs)
+
+        def train():
+            X, targets = prepare_training_data(final_df)
+            return X, train_models(X, targets, mode=args.train_mode)
+        X, (models, scores, _) = run_stage(results, 'train', train)
+
+        cache = PredictionCache()
+        rows = run_stage(results, 'predict', stream_predictions, engine, models, list(X.columns),
+                         range(1995, 2040), chunk_rows=args.chunk_rows, cache=cache)
+
+        def report():
+            aggregates = country_year_aggregates(load_comparison(engine))
+            return render_reports(aggregates, os.path.join(work_dir, 'charts'), workers=args.workers)
+        charts = run_stage(results, 'report', report)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': vars(args),
+        'platform': {
+            'python': sys.version.split()[0],
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'system': platform.system(),
+            'cpu_count': os.cpu_count(),
+        },
+        'sizes': {
+            'eia_rows': {pollutant: len(df) for pollutant, df in pollutant_dfs.items()},
+            'combined_rows': len(final_df),
+            'training_rows': len(X),
+            'predicted_rows': rows,
+            'charts': len(charts),
+        },
+        'metrics': {label: {'r2': float(r2), 'rmse': float(rmse)} for label, (r2, rmse) in scores.items()},
+        'stages': results,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark of the estimator backends in model_functions.py on the same train/test split
+
+For every backend: fit time, predict throughput (rows per second on the test split), pickled model size
+and R²/RMSE per pollutant. Training data is the synthetic EIA data (see synthetic_data.py), or the
+co2/so2/nox_emissions tables of an existing database with --database.
+
+Usage: python benchmark_models.py --eia-plants 5000 --years 2013-2023
+       python benchmark_models.py --database power_plant_data.db
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+import pandas as pd
+import sklearn
+
+from synthetic_data import make_eia_workbooks, parse_years
+from ingest_functions import load_emissions, pollutants
+from combine_functions import combine_emissions
+from model_functions import prepare_training_data, split_data, make_estimator, estimator_backends, evaluate
+from storage_functions import create_sqlite_engine
+
+
+def training_data(args):
+    """X, targets from the database tables or from freshly generated synthetic workbooks"""
+    if args.database:
+        engine = create_sqlite_engine(args.database)
+        pollutant_dfs = {pollutant: pd.read_sql_table(f'{pollutant.lower()}_emissions', engine) for pollutant in pollutants}
+        return prepare_training_data(combine_emissions(pollutant_dfs))
+    work_dir = tempfile.mkdtemp(prefix='model_bench_')
+    try:
+        files = make_eia_workbooks(work_dir, parse_years(args.years), args.eia_plants, args.seed)
+        pollutant_dfs = load_emissions(work_dir, files, cache_dir=os.path.join(work_dir, 'cache'))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return prepare_training_data(combine_emissions(pollutant_dfs))
+
+
+def benchmark_backend(backend, X_train, X_test, Y_train, Y_test, args):
+    """Fit one model per pollutant and measure it"""
+    models = {}
+    start = time.perf_counter()
+    for label in Y_train.columns:
+        models[label] = make_estimator(backend, args.n_estimators, args.seed, args.n_jobs).fit(X_train, Y_train[label])
+    fit_seconds = time.perf_counter() - start
+
+    metrics = {}
+    start = time.perf_counter()
+    for label, model in models.items():
+        r2, rmse = evaluate(Y_test[label], model.predict(X_test))
+        metrics[label] = {'r2': round(float(r2), 4), 'rmse': round(float(rmse), 4)}
+    predict_seconds = time.perf_counter() - start
+    predicted_rows = len(X_test) * len(models)
+
+    return {
+        'backend': backend,
+        'fit_seconds': round(fit_seconds, 3),
+        'predict_seconds': round(predict_seconds, 3),
+        'predict_rows_per_second': round(predicted_rows / predict_seconds) if predict_seconds > 0 else None,
+        'model_size_mb': round(len(pickle.dumps(models)) / 2**20, 2),
+        'metrics': metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the estimator backends on the same train/test split")
+    parser.add_argument('--backends', nargs='+', default=list(estimator_backends), choices=list(estimator_backends))
+    parser.add_argument('--database', default=None, help="use the emissions tables of this SQLite database instead of synthetic data")
+    parser.add_argument('--eia-plants', type=int, default=5000, help="plants in every synthetic EIA workbook")
+    parser.add_argument('--years', default='2013-2023', help="synthetic EIA workbook years")
+    parser.add_argument('--n-estimators', type=int, default=100, help="trees (forest) or boosting iterations")
+    parser.add_argument('--n-jobs', type=int, default=-1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default='benchmarks', help="directory for the JSON results")
+    args = parser.parse_args()
+
+    X, targets = training_data(args)
+    X_train, X_test, Y_train, Y_test = split_data(X, targets, random_state=args.seed)
+    print(f"{len(X_train)} training rows, {len(X_test)} test rows, features {list(X.columns)}")
+
+    results = []
+    for backend in args.backends:
+        result = benchmark_backend(backend, X_train, X_test, Y_train, Y_test, args)
+        results.append(result)
+        scores = '  '.join(f"{label} R² {m['r2']:.3f}" for label, m in result['metrics'].items())
+        print(f"{backend:<24} fit {result['fit_seconds']:>8.2f} s   predict {result['predict_rows_per_second'] or 0:>12,} rows/s   "
+              f"size {result['model_size_mb']:>8.2f} MB   {scores}")
+
+    output = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': vars(args),
+        'platform': {
+            'python': sys.version.split()[0],
+            'sklearn': sklearn.__version__,
+            'machine': platform.machine(),
+            'system': platform.system(),
+            'cpu_count': os.cpu_count(),
+        },
+        'sizes': {'training_rows': len(X_train), 'test_rows': len(X_test)},
+        'backends': results,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"models_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    main()
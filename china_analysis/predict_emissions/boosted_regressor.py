@@ -0,0 +1,42 @@
+"""
+BoostedRegressor: the estimator of the 'hist_gradient_boosting' backend in model_functions.py
+
+Kept in its own module so sklearn is only imported when this backend is used.
+"""
+
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.inspection import permutation_importance
+
+
+class BoostedRegressor(HistGradientBoostingRegressor):
+    """
+    HistGradientBoostingRegressor with a feature_importances_ like the forest's, so the importance plots work
+    for both backends: mean permutation importance on (a sample of) the rows given to set_importance_data,
+    normalized to sum to 1. It is computed on first access, so fit (and a warm start refresh) only boosts.
+    """
+
+    importance_rows = 5000
+
+    def set_importance_data(self, X, y):
+        """Rows to compute feature_importances_ on (e.g. the test split), at most importance_rows of them"""
+        rows = min(len(X), self.importance_rows)
+        rng = np.random.default_rng(0 if self.random_state is None else self.random_state)
+        sample = np.sort(rng.choice(len(X), size=rows, replace=False))
+        self._importance_X = X.iloc[sample] if hasattr(X, 'iloc') else X[sample]
+        self._importance_y = y.iloc[sample] if hasattr(y, 'iloc') else np.asarray(y)[sample]
+        self._importances = None
+        return self
+
+    @property
+    def feature_importances_(self):
+        if getattr(self, '_importance_X', None) is None:
+            raise AttributeError("feature_importances_ needs rows to permute, call set_importance_data(X, y) first")
+        # kept until the data or the number of boosting iterations (warm start) changes
+        cached = getattr(self, '_importances', None)
+        if cached is None or cached[0] != self.n_iter_:
+            importances = permutation_importance(self, self._importance_X, self._importance_y, n_repeats=3,
+                                                 random_state=self.random_state).importances_mean
+            importances = np.clip(importances, 0, None)
+            self._importances = (self.n_iter_, importances / importances.sum() if importances.sum() > 0 else importances)
+        return self._importances[1]
@@ -0,0 +1,165 @@
+"""
+Capacity functions: generating capacity (MW) of AidData energy projects, from their title and description
+
+Projects are streamed from the AidData MySQL database in chunksize batches (server-side cursor), and every
+batch goes through one precompiled pattern that reads the first capacity mentioned in the title, or in the
+description when the title has none:
+- MW, GW and kW (also spelled out: megawatts, ...), converted to MW; MWh/GWh (energy, not capacity) are skipped
+- thousands separators ("1,200 MW") and ranges ("100-150 MW", "100 to 150 MW"; the upper end is used)
+- unit counts ("2 x 300 MW" = 600 MW)
+Each batch is upserted into the project_capacity table as it is read, so an interrupted run keeps what it wrote
+and resume=True continues after the last record. project_plants turns the table into plant rows for the predictor.
+"""
+
+import re
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from storage_functions import create_table, create_indexes, quote, schemas
+from predict_functions import skip_technologies, hours_per_year, predict_chunk
+
+project_query = """
+SELECT p.aid_data_record_id, p.aid_data_parent_id, p.title, p.completion_year, c.name, p.description
+FROM sectors as s
+JOIN projects as p ON p.sector_id = s.id
+JOIN countries as c ON p.recipient_country_id = c.id
+JOIN flow_types as f ON p.flow_type_id = f.id
+JOIN status_types as st ON p.status_id = st.id
+WHERE s.name = 'ENERGY'
+AND p.recommended_for_aggregates = 1
+AND f.simplified != 'Debt Rescheduling'
+AND st.status != 'Cancelled'
+AND p.completion_year IS NOT NULL
+AND (p.title REGEXP %(pattern)s OR p.description REGEXP %(pattern)s)
+AND p.aid_data_record_id > %(last_id)s
+ORDER BY p.aid_data_record_id
+"""
+
+number = r'\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?'
+capacity_pattern = re.compile(
+    r'(?P<text>'
+    rf'(?:(?P<units>\d+)\s*[x×]\s*)?'
+    rf'(?P<low>{number})'
+    rf'(?:\s*(?:-|–|to)\s*(?P<high>{number}))?'
+    r'\s*(?P<unit>[GMk]W[ep]?|(?:giga|mega|kilo)[\s-]?watts?(?!\s?hours?))'
+    r')(?![a-z])',
+    re.IGNORECASE
+)
+prefilter = '[0-9] ?([GMk]W|(giga|mega|kilo)[ -]?watt)'  # MySQL REGEXP, so only projects that can match are sent over
+unit_to_mw = {'g': 1000.0, 'm': 1.0, 'k': 0.001}
+
+fuel_pattern = re.compile(
+    r'\b(?P<fuel>coal|lignite|natural gas|gas|lng|oil|diesel|heavy fuel|hydro\w*|solar|photovoltaic|wind|nuclear|biomass|geothermal|waste)\b',
+    re.IGNORECASE
+)
+fuel_technology = {
+    'lignite': 'coal', 'natural gas': 'gas', 'lng': 'gas', 'diesel': 'oil', 'heavy fuel': 'oil',
+    'photovoltaic': 'solar',
+}
+
+
+def extract_capacities(texts):
+    """
+    First capacity mentioned in every text, in MW, with the range ends and the matched text.
+    One vectorized pass of the compiled pattern.
+    """
+    found = texts.fillna('').str.extract(capacity_pattern)
+    low = pd.to_numeric(found['low'].str.replace(',', ''), errors='coerce')
+    high = pd.to_numeric(found['high'].str.replace(',', ''), errors='coerce').fillna(low)
+    units = pd.to_numeric(found['units'], errors='coerce').fillna(1)
+    scale = found['unit'].str[0].str.lower().map(unit_to_mw)
+    return pd.DataFrame({
+        'capacity_mw': high * units * scale,
+        'capacity_low_mw': low * units * scale,
+        'capacity_high_mw': high * units * scale,
+        'capacity_text': found['text'],
+    }, index=texts.index)
+
+
+def extract_technologies(texts):
+    """First fuel or technology named in every text, in the power_plant table's technology names"""
+    fuel = texts.fillna('').str.extract(fuel_pattern)['fuel'].str.lower()
+    fuel = fuel.where(~fuel.str.startswith('hydro', na=False), 'hydropower')
+    return fuel.replace(fuel_technology)
+
+
+def project_capacities(projects):
+    """project_capacity rows for one batch of projects: the title is searched first, then the description"""
+    # one pass over both columns: a title match comes before anything in the description
+    texts = projects['title'].fillna('') + '\n' + projects['description'].fillna('')
+    capacities = extract_capacities(texts)
+    in_title = [isinstance(match, str) and match in title for title, match in zip(projects['title'].fillna(''), capacities['capacity_text'])]
+    return pd.DataFrame({
+        'aid_data_record_id': projects['aid_data_record_id'].astype('Int64'),
+        'aid_data_parent_id': projects['aid_data_parent_id'].astype('Int64'),
+        'title': projects['title'],
+        'completion_year': projects['completion_year'].astype('Int64'),
+        'country': projects['name'],
+        'technology': extract_technologies(texts),
+        'capacity_mw': capacities['capacity_mw'],
+        'capacity_low_mw': capacities['capacity_low_mw'],
+        'capacity_high_mw': capacities['capacity_high_mw'],
+        'capacity_text': capacities['capacity_text'],
+        'capacity_source': np.where(capacities['capacity_mw'].isna(), None, np.where(in_title, 'title', 'description')),
+    })
+
+
+def upsert_capacities(conn, capacities, table='project_capacity'):
+    """Insert or replace one batch by aid_data_record_id"""
+    cols = [col for col, _ in schemas[table]]
+    rows = capacities[cols].astype(object).where(capacities[cols].notna(), None).values.tolist()
+    conn.exec_driver_sql(
+        f"INSERT OR REPLACE INTO {quote(table)} ({', '.join(quote(col) for col in cols)}) VALUES ({', '.join('?' for _ in cols)})",
+        [tuple(row) for row in rows]
+    )
+
+
+def last_record_id(engine, table='project_capacity'):
+    with engine.begin() as conn:
+        create_table(conn, table)
+        return conn.execute(text(f"SELECT COALESCE(MAX(aid_data_record_id), 0) FROM {quote(table)}")).scalar()
+
+
+def stream_capacities(source_engine, engine, chunksize=5_000, resume=False, table='project_capacity'):
+    """
+    Read the AidData energy projects in chunksize batches and upsert their capacities into table (in engine),
+    one transaction per batch. resume=True starts after the highest record id already in the table.
+    Returns (projects read, projects with a capacity).
+    """
+    last_id = last_record_id(engine, table) if resume else 0
+    with engine.begin() as conn:
+        create_table(conn, table, replace=not resume)
+    create_indexes(engine, [table])
+
+    read = found = 0
+    with source_engine.connect().execution_options(stream_results=True) as source:
+        batches = pd.read_sql_query(project_query, con=source, params={'pattern': prefilter, 'last_id': last_id}, chunksize=chunksize)
+        for projects in batches:
+            capacities = project_capacities(projects)
+            with engine.begin() as conn:
+                upsert_capacities(conn, capacities, table)
+            read += len(projects)
+            found += int(capacities['capacity_mw'].notna().sum())
+            print(f"{read:,} projects read, {found:,} with a capacity")
+    return read, found
+
+
+def project_plants(capacities, overrides=None, default_technology='coal'):
+    """
+    Plant rows the predictor understands (id, mw, year_commission, technology, country) from project_capacity rows.
+    overrides: {aid_data_record_id: MW} for capacities fixed by hand. Projects without a technology get
+    default_technology; hydropower, solar, wind etc. are left out like in the power plant data.
+    """
+    plants = capacities.rename(columns={'aid_data_record_id': 'id', 'capacity_mw': 'mw', 'completion_year': 'year_commission'})
+    if overrides:
+        plants['mw'] = plants['id'].map(overrides).fillna(plants['mw'])
+    plants['technology'] = plants['technology'].fillna(default_technology)
+    plants = plants[plants['mw'].notna() & ~plants['technology'].isin(skip_technologies)]
+    return plants[['id', 'mw', 'year_commission', 'technology', 'country']].reset_index(drop=True)
+
+
+def predict_projects(plants, models, features, capacity_factor=1.0, cache=None):
+    """Emissions of every project in its completion year, at capacity_factor of the 8760 full-load hours"""
+    df = plants.rename(columns={'year_commission': 'year'}).copy()
+    df['generation_mwh'] = df['mw'] * hours_per_year * capacity_factor
+    return predict_chunk(df, models, features, cache)
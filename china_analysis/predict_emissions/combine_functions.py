@@ -0,0 +1,201 @@
+"""
+Combine functions: bring the CO2, SO2 and NOx tables together into one emissions table
+
+By default the three tables are lined up on plant, year AND fuel group, so there is one row per
+(plant, year, fuel group) and the table grows with the number of plants.
+With by_fuel_group=False the original plant and year join is kept: a plant with k fuel groups
+fans out to k^3 joined rows, which are collapsed to plant-year and split back out by fuel group.
+
+Two backends give the same result:
+- 'pandas' (default): in-process, never builds the fanned-out join rows
+- 'spark': the Spark aggregation, fed straight from the pandas dataframes (no csv middleman)
+'auto' measures the pollutant tables and only starts Spark (and its JVM) above spark_threshold_mb.
+"""
+
+import pandas as pd
+from dtype_functions import compact_dtypes, report_memory
+from startup_functions import lazy_import, start, is_available
+
+key_cols = ['Plant Code', 'Year']
+fuel_key_cols = ['Plant Code', 'Aggregated Fuel Group', 'Year']
+output_cols = ['plant_id', 'Year', 'generation_kwh', 'co2_emissions', 'so2_emissions', 'nox_emissions', 'fuel_group']
+
+
+def plant_year_sums(df, value_cols):
+    """Per plant-year row count and null-aware sums of the value columns"""
+    grouped = df.groupby(key_cols)
+    sums = grouped[value_cols].sum(min_count=1)
+    sums['rows'] = grouped.size()
+    return sums
+
+
+def join_fanout(pollutant_dfs):
+    """Number of rows the plant and year LEFT JOIN would produce (sum of a*max(b,1)*max(c,1))"""
+    a = pollutant_dfs['CO2'].groupby(key_cols).size()
+    b = pollutant_dfs['SO2'].groupby(key_cols).size().reindex(a.index, fill_value=0).clip(lower=1)
+    c = pollutant_dfs['NOx'].groupby(key_cols).size().reindex(a.index, fill_value=0).clip(lower=1)
+    return int((a * b * c).sum())
+
+
+def report_row_counts(pollutant_dfs, combined_rows):
+    """
+    Fan-out guard: print rows in and out of the combine step, and fail if the
+    combined table is bigger than the pollutant tables put together
+    """
+    input_rows = {pollutant: len(df) for pollutant, df in pollutant_dfs.items()}
+    counts = ', '.join(f"{pollutant} {rows:,}" for pollutant, rows in input_rows.items())
+    print(f"Combine rows in: {counts} -> out: {combined_rows:,} "
+          f"(plant and year join would have made {join_fanout(pollutant_dfs):,})")
+    if combined_rows > sum(input_rows.values()):
+        raise ValueError(f"Combined emissions table fanned out: {combined_rows:,} rows from {sum(input_rows.values()):,} input rows")
+
+
+def pivot_pandas(pollutant_dfs):
+    """
+    One row per (plant, year, fuel group): every pollutant table is indexed on the same keys
+    and lined up side by side (outer), so no key ever matches more than one row per table
+    """
+    frames = []
+    for pollutant, df in pollutant_dfs.items():
+        name = pollutant.lower()
+        indexed = df.set_index(fuel_key_cols)
+        if not indexed.index.is_unique:
+            raise ValueError(f"{pollutant} table has {indexed.index.duplicated().sum()} duplicate plant/fuel group/year keys")
+        frames.append(indexed[['Generation (kWh)', f'{name}_emissions']]
+                      .rename(columns={'Generation (kWh)': f'generation_{name}'}))
+    wide = pd.concat(frames, axis=1, join='outer')
+
+    # generation is reported on every sheet, prefer the CO2 one like the old join did
+    wide['generation_kwh'] = wide['generation_co2'].combine_first(wide['generation_so2']).combine_first(wide['generation_nox'])
+    wide = wide.reset_index().rename(columns={'Plant Code': 'plant_id', 'Aggregated Fuel Group': 'fuel_group'})
+    wide['fuel_group'] = wide['fuel_group'].astype(str).str.strip()
+    return wide[output_cols]
+
+
+def collapse_pandas(pollutant_dfs):
+    """
+    Same numbers as the SQL LEFT JOIN on plant and year followed by the Spark groupBy/sum.
+    For a plant-year with a CO2 rows, b SO2 rows and c NOx rows the join repeats every CO2 row
+    max(b,1)*max(c,1) times, every SO2 row a*max(c,1) times and every NOx row a*max(b,1) times,
+    so the sums are scaled by those counts instead of building the joined rows.
+    """
+    co2 = plant_year_sums(pollutant_dfs['CO2'], ['Generation (kWh)', 'co2_emissions'])
+    so2 = plant_year_sums(pollutant_dfs['SO2'], ['so2_emissions'])
+    nox = plant_year_sums(pollutant_dfs['NOx'], ['nox_emissions'])
+
+    # left join from co2, like the SQL query
+    combined = co2.join(so2, rsuffix='_so2').join(nox, rsuffix='_nox')
+    a = combined['rows']
+    b = combined['rows_so2'].fillna(0)
+    c = combined['rows_nox'].fillna(0)
+
+    collapsed = pd.DataFrame({
+        'generation_kwh': combined['Generation (kWh)'] * b.clip(lower=1) * c.clip(lower=1),
+        'co2_emissions': combined['co2_emissions'] * b.clip(lower=1) * c.clip(lower=1),
+        'so2_emissions': combined['so2_emissions'] * a * c.clip(lower=1),
+        'nox_emissions': combined['nox_emissions'] * a * b.clip(lower=1),
+    }, index=combined.index)
+
+    # explode: one row per fuel group the plant reported CO2 for in that year
+    fuel_groups = (
+        pollutant_dfs['CO2'][key_cols + ['Aggregated Fuel Group']]
+        .dropna()
+        .rename(columns={'Aggregated Fuel Group': 'fuel_group'})
+    )
+    fuel_groups['fuel_group'] = fuel_groups['fuel_group'].astype(str).str.strip()
+    exploded = collapsed.reset_index().merge(fuel_groups.drop_duplicates(), on=key_cols, how='left')
+    exploded = exploded.rename(columns={'Plant Code': 'plant_id'})
+    return exploded[output_cols]
+
+
+def combine_pandas(pollutant_dfs, by_fuel_group=True):
+    """In-process combine, see pivot_pandas and collapse_pandas"""
+    if by_fuel_group:
+        return pivot_pandas(pollutant_dfs)
+    return collapse_pandas(pollutant_dfs)
+
+
+def combine_spark(pollutant_dfs, by_fuel_group=True, spark=None):
+    """Spark join and aggregation, without the csv round trip"""
+    lazy_import('pyspark.sql.functions')  # times the pyspark import
+    from pyspark.sql import SparkSession
+    from pyspark.sql.functions import sum as spark_sum, collect_set, concat_ws
+    from pyspark.sql.functions import split, explode, trim, coalesce, col
+
+    if spark is None:
+        spark = start('spark session', lambda: SparkSession.builder.appName("EmissionsAggregation").getOrCreate())
+
+    if by_fuel_group:
+        frames = []
+        for pollutant, df in pollutant_dfs.items():
+            name = pollutant.lower()
+            frames.append(spark.createDataFrame(
+                df[fuel_key_cols + ['Generation (kWh)', f'{name}_emissions']]
+                .rename(columns={'Generation (kWh)': f'generation_{name}'})
+            ))
+        wide = frames[0].join(frames[1], on=fuel_key_cols, how='full').join(frames[2], on=fuel_key_cols, how='full')
+        wide = (
+            wide.withColumn('generation_kwh', coalesce(col('generation_co2'), col('generation_so2'), col('generation_nox')))
+            .withColumnRenamed('Plant Code', 'plant_id')
+            .withColumnRenamed('Aggregated Fuel Group', 'fuel_group')
+            .withColumn('fuel_group', trim('fuel_group'))
+        )
+        return wide.toPandas()[output_cols]
+
+    co2 = spark.createDataFrame(pollutant_dfs['CO2'])
+    so2 = spark.createDataFrame(pollutant_dfs['SO2'][key_cols + ['so2_emissions']])
+    nox = spark.createDataFrame(pollutant_dfs['NOx'][key_cols + ['nox_emissions']])
+
+    joined = (
+        co2.join(so2, on=key_cols, how='left')
+        .join(nox, on=key_cols, how='left')
+        .withColumnRenamed('Plant Code', 'plant_id')
+    )
+    #"taking turns" collapse: a single row for each plant and year
+    collapsed_df = (
+        joined.groupBy("plant_id", "Year")
+        .agg(
+            spark_sum("Generation (kWh)").alias("generation_kwh"),
+            spark_sum("co2_emissions").alias("co2_emissions"),
+            spark_sum("so2_emissions").alias("so2_emissions"),
+            spark_sum("nox_emissions").alias("nox_emissions"),
+            concat_ws(",", collect_set("Aggregated Fuel Group")).alias("fuel_group")
+        )
+    )
+    #split by fuel group, so that each fuel group is its own row, which will repeat plants and years
+    exploded_df = (
+        collapsed_df
+        .withColumn("fuel_group", explode(split("fuel_group", ",")))
+        .withColumn("fuel_group", trim("fuel_group"))
+    )
+    return exploded_df.toPandas()[output_cols]
+
+
+combine_backends = {
+    'pandas': combine_pandas,
+    'spark': combine_spark,
+}
+
+
+def input_size_mb(pollutant_dfs):
+    return sum(df.memory_usage(deep=True).sum() for df in pollutant_dfs.values()) / 2**20
+
+
+def choose_backend(pollutant_dfs, spark_threshold_mb=2048):
+    """'spark' when the pollutant tables are at least spark_threshold_mb and pyspark is installed, else 'pandas'"""
+    size = input_size_mb(pollutant_dfs)
+    backend = 'spark' if size >= spark_threshold_mb and is_available('pyspark') else 'pandas'
+    print(f"Combine input {size:,.1f} MB (Spark threshold {spark_threshold_mb:,} MB) -> {backend}")
+    return backend
+
+
+def combine_emissions(pollutant_dfs, backend='pandas', by_fuel_group=True, spark_threshold_mb=2048, **kwargs):
+    """Combine the pollutant tables on the chosen backend ('auto' picks by input size) and report the row counts"""
+    if backend == 'auto':
+        backend = choose_backend(pollutant_dfs, spark_threshold_mb)
+    if backend not in combine_backends:
+        raise ValueError(f"Unknown combine backend '{backend}', choose from {list(combine_backends)}")
+    combined = compact_dtypes(combine_backends[backend](pollutant_dfs, by_fuel_group=by_fuel_group, **kwargs))
+    report_row_counts(pollutant_dfs, len(combined))
+    report_memory('Combined emissions', combined)
+    return combined
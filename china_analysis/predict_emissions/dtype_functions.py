@@ -0,0 +1,78 @@
+"""
+Dtype functions: one memory-compact dtype policy for the emissions pipeline
+
+- plant ids, plant codes and years -> int32
+- fuel groups, countries and technologies -> category (a small integer code per row instead of a string)
+- emissions -> float32 (about 7 significant digits, well inside the precision of the EIA numbers)
+Generation in kWh stays float64: plant totals run to 1e10 kWh and are summed and scaled in the combine step.
+
+report_memory prints what a dataframe takes next to what it would take with pandas' default
+int64/float64/object columns, so the saving is visible at every stage.
+"""
+
+import numpy as np
+import pandas as pd
+
+int_cols = ['Plant Code', 'plant_id', 'Year', 'year', 'id', 'year_commission']
+category_cols = ['Aggregated Fuel Group', 'fuel_group', 'country', 'technology']
+float_cols = [
+    'co2_emissions', 'so2_emissions', 'nox_emissions',
+    'pred_co2_emissions', 'pred_so2_emissions', 'pred_nox_emissions',
+]
+int32_range = (np.iinfo(np.int32).min, np.iinfo(np.int32).max)
+
+
+def compact_dtypes(df):
+    """Apply the dtype policy to the columns of df that it covers (in place), returns df"""
+    for col in df.columns.intersection(int_cols):
+        values = df[col]
+        if values.dtype == np.int32 or values.isna().any():
+            continue
+        if values.empty or (int32_range[0] <= values.min() and values.max() <= int32_range[1]):
+            df[col] = values.astype(np.int32)
+    for col in df.columns.intersection(category_cols):
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col in df.columns.intersection(float_cols):
+        df[col] = df[col].astype(np.float32)
+    return df
+
+
+def compact_frames(dfs):
+    """compact_dtypes for a {name: dataframe} dict, with the same categories in every frame so they still line up and concat"""
+    dfs = {name: compact_dtypes(df) for name, df in dfs.items()}
+    for col in category_cols:
+        frames = [df for df in dfs.values() if col in df.columns]
+        if len(frames) < 2:
+            continue
+        categories = pd.Index(sorted(set().union(*(df[col].cat.categories for df in frames)), key=str))
+        for df in frames:
+            df[col] = df[col].cat.set_categories(categories)
+    return dfs
+
+
+def default_memory(df):
+    """Bytes df would take with pandas' default int64/float64/object dtypes, without converting the whole frame"""
+    total = df.index.memory_usage(deep=True)
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            total += values.astype(object).memory_usage(index=False, deep=True)
+        elif values.dtype.kind in 'iufb':
+            total += len(values) * 8
+        else:
+            total += values.memory_usage(index=False, deep=True)
+    return total
+
+
+def memory(df):
+    return df.memory_usage(deep=True).sum()
+
+
+def report_memory(name, dfs):
+    """Print default vs compact memory of one dataframe or a {name: dataframe} dict, returns (default, compact) bytes"""
+    frames = dfs.values() if isinstance(dfs, dict) else [dfs]
+    before = sum(default_memory(df) for df in frames)
+    after = sum(memory(df) for df in frames)
+    print(f"{name} memory: {before / 2**20:,.1f} MB with default dtypes -> {after / 2**20:,.1f} MB compact")
+    return before, after
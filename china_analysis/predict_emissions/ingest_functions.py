@@ -0,0 +1,298 @@
+"""
+Ingest functions for the EIA emissions workbooks (emissions{year}.xlsx)
+
+Each workbook is parsed once for all three pollutant sheets and the cleaned
+sheets are written to a parquet cache, so reruns skip the Excel parsing.
+The incremental functions keep an ingest_log table in the SQLite database, so
+only new or changed workbooks (one year partition each) are written again.
+Every table is returned with the compact dtypes of dtype_functions.py.
+"""
+
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import inspect, text
+from storage_functions import bulk_insert, create_indexes, create_table, schemas
+from dtype_functions import compact_dtypes, compact_frames, report_memory
+
+pollutants = {
+    'CO2': 'Metric Tonnes of CO2 Emissions',
+    'SO2': 'Selected SO2 Emissions (Metric Tonnes)',
+    'NOx': 'Selected NOx Emissions (Metric Tonnes)'
+}
+group_cols = ['Plant Code', 'Aggregated Fuel Group', 'Year']
+cache_dirname = '.eia_cache'
+manifest_name = 'manifest.json'
+
+
+def workbook_year(filename):
+    """Get the year out of an emissions{year}.xlsx file name"""
+    return int(os.path.basename(filename).replace('emissions', '').replace('.xlsx', ''))
+
+
+def file_hash(filepath, block_size=1 << 20):
+    """sha256 of the file contents, read in blocks"""
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def clean_sheet(df, pollutant, year):
+    """Keep the relevant columns of one pollutant sheet and group by plant, fuel group and year"""
+    emission_col = pollutants[pollutant]
+    df.columns = [col.strip() for col in df.columns]  # Remove whitespace
+    df['Year'] = year
+
+    # Drop non-numeric Plant Codes (footnotes, etc.)
+    df = df[pd.to_numeric(df['Plant Code'], errors='coerce').notna()]
+    df = df[['Plant Code', 'Aggregated Fuel Group', 'Generation (kWh)', 'Year', emission_col]].copy()
+    df['Plant Code'] = df['Plant Code'].astype(int)
+    df['Generation (kWh)'] = pd.to_numeric(df['Generation (kWh)'], errors='coerce')
+    df[emission_col] = pd.to_numeric(df[emission_col], errors='coerce')
+    df = df.rename(columns={emission_col: f'{pollutant.lower()}_emissions'})
+
+    #plants are split up by other factors like "prime mover" that wont matter in the Chinese dataset,
+    #so we just group by the plant, observation year, and observation fuel group
+    return compact_dtypes(df.groupby(group_cols, as_index=False).sum())
+
+
+def parse_workbook(filepath):
+    """Read the CO2, SO2 and NOx sheets of one workbook in a single pass"""
+    year = workbook_year(filepath)
+    sheets = pd.read_excel(filepath, sheet_name=list(pollutants), skiprows=1)
+    return {pollutant: clean_sheet(sheets[pollutant], pollutant, year) for pollutant in pollutants}
+
+
+def read_manifest(cache_dir):
+    """Cache manifest: file name -> size, mtime and sha256 of the cached workbook"""
+    path = os.path.join(cache_dir, manifest_name)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(cache_dir, manifest):
+    """Write the manifest atomically so an interrupted run can't corrupt it"""
+    path = os.path.join(cache_dir, manifest_name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def cache_path(cache_dir, filename, pollutant):
+    return os.path.join(cache_dir, f"{os.path.splitext(filename)[0]}_{pollutant.lower()}.parquet")
+
+
+def cache_is_fresh(filepath, entry):
+    """
+    Check a workbook against its manifest entry.
+    Size and mtime matching is the fast path; otherwise fall back to comparing the content hash
+    (a copied or touched file keeps its cache). Returns (fresh, stat_key).
+    """
+    stat = os.stat(filepath)
+    key = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if not entry or entry.get('size') != key['size']:
+        return False, key
+    if entry.get('mtime') == key['mtime']:
+        return True, dict(key, sha256=entry['sha256'])
+    key['sha256'] = file_hash(filepath)
+    return key['sha256'] == entry.get('sha256'), key
+
+
+def load_workbook(filepath, cache_dir=None, manifest=None):
+    """
+    Load the cleaned pollutant sheets of one workbook, from the parquet cache when the
+    workbook is unchanged, otherwise parse it and refresh the cache.
+    Returns (sheets, manifest entry).
+    """
+    filename = os.path.basename(filepath)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(filepath), cache_dirname)
+    if manifest is None:
+        manifest = read_manifest(cache_dir)
+    entry = manifest.get(filename)
+
+    fresh, key = cache_is_fresh(filepath, entry)
+    paths = {pollutant: cache_path(cache_dir, filename, pollutant) for pollutant in pollutants}
+    if fresh and all(os.path.exists(p) for p in paths.values()):
+        return {pollutant: pd.read_parquet(p) for pollutant, p in paths.items()}, key
+
+    sheets = parse_workbook(filepath)
+    os.makedirs(cache_dir, exist_ok=True)
+    for pollutant, df in sheets.items():
+        df.to_parquet(paths[pollutant], index=False)
+    if 'sha256' not in key:
+        key['sha256'] = file_hash(filepath)
+    return sheets, key
+
+
+def load_emissions(directory, files, cache_dir=None, workers=1, return_failed=False):
+    """
+    Load every workbook (cached where possible) and combine into one dataframe per pollutant.
+    With workers > 1 the workbooks are parsed, filtered and grouped on a process pool; results are
+    merged in file order, so the output doesn't depend on which worker finishes first.
+    Workbooks that can't be read are reported and skipped; return_failed=True returns (pollutant_dfs, failed files),
+    with empty tables when none could be read.
+    The calling script needs an `if __name__ == "__main__":` guard for the pool on Windows.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(directory, cache_dirname)
+    manifest = read_manifest(cache_dir)
+    filepaths = [os.path.join(directory, file) for file in files]
+
+    loaded = {}
+    if workers is not None and workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(files))) as pool:
+            futures = {file: pool.submit(load_workbook, path, cache_dir, manifest) for file, path in zip(files, filepaths)}
+            for file, future in futures.items():
+                try:
+                    loaded[file] = future.result()
+                except Exception as e:
+                    print(f"Error reading {file}: {e}")
+    else:
+        for file, path in zip(files, filepaths):
+            try:
+                loaded[file] = load_workbook(path, cache_dir, manifest)
+            except Exception as e:
+                print(f"Error reading {file}: {e}")
+
+    all_years = {pollutant: [] for pollutant in pollutants}
+    for file in files:
+        if file not in loaded:
+            continue
+        sheets, manifest[file] = loaded[file]
+        for pollutant, df in sheets.items():
+            all_years[pollutant].append(df)
+
+    if os.path.isdir(cache_dir):
+        write_manifest(cache_dir, manifest)
+    failed = [file for file in files if file not in loaded]
+    if not loaded:
+        if not return_failed:
+            raise ValueError(f"None of the emissions workbooks could be read: {failed}")
+        return {pollutant: pd.DataFrame() for pollutant in pollutants}, failed
+    # concat turns categories that differ between years back into strings, so the policy is applied to the merged tables
+    pollutant_dfs = compact_frames({pollutant: pd.concat(dfs, ignore_index=True) for pollutant, dfs in all_years.items()})
+    report_memory('EIA emissions tables', pollutant_dfs)
+    if return_failed:
+        return pollutant_dfs, failed
+    return pollutant_dfs
+
+
+########## INCREMENTAL SQL INGEST ##########
+
+def read_ingest_log(engine):
+    """Which source files are loaded into the database, with the year partition they fill and their hash"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS ingest_log (
+                source TEXT PRIMARY KEY,
+                year INTEGER,
+                size INTEGER,
+                sha256 TEXT,
+                loaded_at TEXT
+            )
+        """))
+    return pd.read_sql_query("SELECT * FROM ingest_log", con=engine).set_index('source')
+
+
+def log_source(conn, source, filepath, sha256, year=None):
+    """Record a loaded source file, inside the same transaction as its rows"""
+    conn.execute(
+        text("INSERT OR REPLACE INTO ingest_log (source, year, size, sha256, loaded_at) "
+             "VALUES (:source, :year, :size, :sha256, :loaded_at)"),
+        {"source": source, "year": year, "size": os.path.getsize(filepath), "sha256": sha256,
+         "loaded_at": datetime.now().isoformat(timespec='seconds')}
+    )
+
+
+def source_changed(log, source, filepath):
+    """Returns (changed, sha256) for a source file against the ingest log"""
+    sha256 = file_hash(filepath)
+    if source not in log.index:
+        return True, sha256
+    return log.at[source, 'sha256'] != sha256, sha256
+
+
+def replace_table_if_changed(engine, table, filepath, read_func, force=False):
+    """
+    Reload a whole (unpartitioned) table only when its source file changed. read_func(filepath) returns the dataframe.
+    Tables with a typed schema keep only the schema's columns (missing ones are NULL).
+    """
+    log = read_ingest_log(engine)
+    changed, sha256 = source_changed(log, table, filepath)
+    if not force and not changed and inspect(engine).has_table(table):
+        print(f"{table}: unchanged, skipped")
+        return False
+    df = read_func(filepath)
+    with engine.begin() as conn:
+        if table in schemas:
+            create_table(conn, table, replace=True)
+            bulk_insert(conn, table, df.reindex(columns=[col for col, _ in schemas[table]]))
+        else:
+            df.to_sql(table, con=conn, if_exists='replace', index=False)
+        log_source(conn, table, filepath, sha256)
+    create_indexes(engine, [table])
+    print(f"{table}: loaded {len(df):,} rows")
+    return True
+
+
+def write_year_partition(conn, table, df, year):
+    """Delete-then-insert one year partition of an emissions table"""
+    if inspect(conn).has_table(table):
+        conn.execute(text(f'DELETE FROM {table} WHERE "Year" = :year'), {"year": year})
+    bulk_insert(conn, table, df)
+
+
+def load_emissions_incremental(engine, directory, files, cache_dir=None, workers=1):
+    """
+    Write only new or changed workbooks to the {pollutant}_emissions tables, one year partition per workbook,
+    and drop the partitions of workbooks that are gone. Returns the full tables read back from the database.
+    """
+    log = read_ingest_log(engine)
+    changed = {}
+    for file in files:
+        is_changed, sha256 = source_changed(log, file, os.path.join(directory, file))
+        if is_changed:
+            changed[file] = sha256
+    tables = [f'{pollutant.lower()}_emissions' for pollutant in pollutants]
+    if not all(inspect(engine).has_table(table) for table in tables):
+        changed = {file: source_changed(log, file, os.path.join(directory, file))[1] for file in files}
+    removed = [source for source in log.index if source.startswith('emissions') and source not in files]
+    print(f"Emissions workbooks: {len(changed)} new or changed, {len(files) - len(changed)} unchanged, {len(removed)} removed")
+
+    if changed:
+        new_dfs, failed = load_emissions(directory, list(changed), cache_dir=cache_dir, workers=workers, return_failed=True)
+        if failed:
+            # their year partitions keep the rows already loaded and they stay out of ingest_log, so the next run retries them
+            print(f"Emissions workbooks not loaded, will be retried: {failed}")
+        for file, sha256 in changed.items():
+            if file in failed:
+                continue
+            year = workbook_year(file)
+            with engine.begin() as conn:
+                for pollutant, df in new_dfs.items():
+                    write_year_partition(conn, f'{pollutant.lower()}_emissions', df[df['Year'] == year], year)
+                log_source(conn, file, os.path.join(directory, file), sha256, year)
+
+    if removed:
+        with engine.begin() as conn:
+            for source in removed:
+                for table in tables:
+                    conn.execute(text(f'DELETE FROM {table} WHERE "Year" = :year'), {"year": int(log.at[source, 'year'])})
+                conn.execute(text("DELETE FROM ingest_log WHERE source = :source"), {"source": source})
+
+    create_indexes(engine, tables)
+    pollutant_dfs = compact_frames({
+        pollutant: pd.read_sql_query(f'SELECT * FROM {pollutant.lower()}_emissions ORDER BY "Year", "Plant Code", "Aggregated Fuel Group"', con=engine)
+        for pollutant in pollutants
+    })
+    report_memory('EIA emissions tables', pollutant_dfs)
+    return pollutant_dfs
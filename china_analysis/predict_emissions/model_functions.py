@@ -0,0 +1,382 @@
+"""
+Model functions for the emissions models (one model per pollutant: co2, so2, nox)
+
+Every target uses the same features and the same train/test split, so the split is made once.
+Training modes:
+- 'separate' (default): one model per target, built on all cores (n_jobs)
+- 'multioutput': one forest fit on all three targets at once, wrapped so each pollutant still has its own .predict
+Estimator backends:
+- 'random_forest' (default): RandomForestRegressor
+- 'hist_gradient_boosting': HistGradientBoostingRegressor, bins the features so it fits much faster on large
+  data and stores a far smaller model (n_estimators is used as its number of boosting iterations)
+
+sklearn is imported on first use (startup_functions.py), so importing this module stays cheap.
+
+Trained models are saved to a versioned model store (model_store/v{n}/) with their feature order, metrics, the years
+they were trained on, their outlier thresholds and a fingerprint of the training data, so a rerun on the same data loads them instead of training again.
+refresh_models handles a new EIA year without a full retrain: the stored models grow extra trees/iterations on the new
+year only (warm start), unless their error on the new year has drifted past a threshold.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from startup_functions import lazy_import
+
+train_modes = ['separate', 'multioutput']
+
+
+def random_forest(n_estimators, random_state, n_jobs):
+    RandomForestRegressor = lazy_import('sklearn.ensemble').RandomForestRegressor
+    return RandomForestRegressor(n_estimators=n_estimators, random_state=random_state, n_jobs=n_jobs)
+
+
+def hist_gradient_boosting(n_estimators, random_state, n_jobs):
+    # threads come from OpenMP (OMP_NUM_THREADS), there is no n_jobs
+    BoostedRegressor = lazy_import('boosted_regressor').BoostedRegressor
+    return BoostedRegressor(max_iter=n_estimators, random_state=random_state)
+
+
+# backend name -> (factory(n_estimators, random_state, n_jobs), can fit several targets at once)
+estimator_backends = {
+    'random_forest': (random_forest, True),
+    'hist_gradient_boosting': (hist_gradient_boosting, False),
+}
+
+
+def make_estimator(backend, n_estimators=100, random_state=42, n_jobs=-1):
+    if backend not in estimator_backends:
+        raise ValueError(f"Unknown estimator backend '{backend}', choose from {list(estimator_backends)}")
+    factory, _ = estimator_backends[backend]
+    return factory(n_estimators, random_state, n_jobs)
+
+
+class TargetColumn:
+    """One pollutant's view of a multi-output model: .predict returns only that target's column"""
+
+    def __init__(self, estimator, column):
+        self.estimator = estimator
+        self.column = column
+
+    def predict(self, X):
+        return self.estimator.predict(X)[:, self.column]
+
+    @property
+    def feature_importances_(self):
+        # a multi-output forest only has importances over all targets together
+        return self.estimator.feature_importances_
+
+
+def prepare_training_data(final_df, thresholds=None, return_thresholds=False):
+    """
+    Features X and log emission targets from the combined EIA table. Rows above the 99th percentile of any
+    emission are dropped; pass thresholds (as returned with return_thresholds=True) to reuse stored cutoffs.
+    """
+    final_df = final_df.copy()
+    # turn generation_kwh to mwh
+    final_df['generation_mwh'] = final_df['generation_kwh'] / 1000
+    #drop kwh
+    final_df = final_df.drop(columns=['generation_kwh'])
+    #change names of the fuel groups PET turn to oil, GAS to gas, and COAL to coal
+    #(as plain strings: a categorical would keep the dropped MSW/GEO categories as dummy columns)
+    final_df['fuel_group'] = final_df['fuel_group'].astype(str).replace({
+        'PET': 'oil',
+        'GAS': 'gas',
+        'COAL': 'coal'
+    })
+    final_df = final_df[~final_df['fuel_group'].isin(['MSW', 'GEO'])] #only wanted to focus on coal, gas, and oil
+
+    final_df = final_df.dropna() #not many nas, not a big deal
+    #replace zeros if necessary to avoid log(0)
+    final_df = final_df[
+        (final_df['co2_emissions'] > 0) &
+        (final_df['so2_emissions'] > 0) &
+        (final_df['nox_emissions'] > 0)
+    ]
+    final_df['log_co2'] = np.log(final_df['co2_emissions']) #will standardize
+    final_df['log_so2'] = np.log(final_df['so2_emissions'])
+    final_df['log_nox'] = np.log(final_df['nox_emissions'])
+
+    #I belive there was a a "test" plant id 9999 that was a huge outlier, so this code will remove that and other possible outliers
+    if thresholds is None:
+        thresholds = {column: float(final_df[column].quantile(0.99)) for column in ['co2_emissions', 'so2_emissions', 'nox_emissions']}
+
+    #keep rows below the 99th percentile for all three
+    final_df = final_df[
+        (final_df['co2_emissions'] <= thresholds['co2_emissions']) &
+        (final_df['so2_emissions'] <= thresholds['so2_emissions']) &
+        (final_df['nox_emissions'] <= thresholds['nox_emissions'])
+    ]
+    final_df.rename(columns={'Year': 'year'}, inplace=True)  # Rename for consistency
+    #machine learning models
+    X = final_df[['generation_mwh', 'year', 'fuel_group']]
+    X = pd.get_dummies(X, columns=['fuel_group'], drop_first=True)
+    ### Make a model for each emission type as the y ###
+    targets = {
+        'co2': final_df['log_co2'],
+        'so2': final_df['log_so2'],
+        'nox': final_df['log_nox']
+    }
+    if return_thresholds:
+        return X, targets, thresholds
+    return X, targets
+
+
+def split_data(X, targets, test_size=0.2, random_state=42):
+    """One train/test split shared by every target (same rows as splitting each target with random_state=42)"""
+    Y = pd.DataFrame(targets)
+    train_test_split = lazy_import('sklearn.model_selection').train_test_split
+    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=test_size, random_state=random_state)
+    return X_train, X_test, Y_train, Y_test
+
+
+def evaluate(y_test, y_pred):
+    """(R², RMSE) on the test split"""
+    metrics = lazy_import('sklearn.metrics')
+    return metrics.r2_score(y_test, y_pred), np.sqrt(metrics.mean_squared_error(y_test, y_pred))
+
+
+def train_models(X, targets, mode='separate', n_jobs=-1, n_estimators=100, random_state=42, backend='random_forest'):
+    """
+    Train one model per target. Returns (models, results, predictions) where
+    results[label] = (r2, rmse) and predictions[label] = (y_test, y_pred) for plotting.
+    """
+    if mode not in train_modes:
+        raise ValueError(f"Unknown training mode '{mode}', choose from {train_modes}")
+    if backend not in estimator_backends:
+        raise ValueError(f"Unknown estimator backend '{backend}', choose from {list(estimator_backends)}")
+    if mode == 'multioutput' and not estimator_backends[backend][1]:
+        raise ValueError(f"Backend '{backend}' fits one target at a time, use mode='separate'")
+    X_train, X_test, Y_train, Y_test = split_data(X, targets, random_state=random_state)
+
+    models = {}
+    if mode == 'multioutput':
+        forest = make_estimator(backend, n_estimators, random_state, n_jobs)
+        forest.fit(X_train, Y_train.values)
+        for column, label in enumerate(Y_train.columns):
+            models[label] = TargetColumn(forest, column)
+    else:
+        for label in Y_train.columns:
+            model = make_estimator(backend, n_estimators, random_state, n_jobs)
+            model.fit(X_train, Y_train[label])
+            models[label] = model
+
+    results, predictions = evaluate_models(models, X_test, Y_test)
+    return models, results, predictions
+
+
+def evaluate_models(models, X_test, Y_test):
+    """results[label] = (r2, rmse) and predictions[label] = (y_test, y_pred) on the test split"""
+    results = {}
+    predictions = {}
+    for label, model in models.items():
+        y_pred = model.predict(X_test)
+        results[label] = evaluate(Y_test[label], y_pred)
+        predictions[label] = (Y_test[label], y_pred)
+    return results, predictions
+
+
+########## MODEL STORE ##########
+
+def training_fingerprint(X, targets, **params):
+    """sha256 over the feature names, feature values, target values and training parameters"""
+    sha = hashlib.sha256()
+    sha.update(json.dumps(list(X.columns)).encode())
+    sha.update(pd.util.hash_pandas_object(X, index=False).values.tobytes())
+    for label, y in targets.items():
+        sha.update(label.encode())
+        sha.update(pd.util.hash_pandas_object(y, index=False).values.tobytes())
+    sha.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return sha.hexdigest()
+
+
+def store_versions(store_dir):
+    """Saved versions in the store, oldest first"""
+    if not os.path.isdir(store_dir):
+        return []
+    versions = [d for d in os.listdir(store_dir) if d.startswith('v') and d[1:].isdigit()]
+    return sorted(versions, key=lambda d: int(d[1:]))
+
+
+def read_metadata(store_dir, version):
+    with open(os.path.join(store_dir, version, 'metadata.json')) as f:
+        return json.load(f)
+
+
+def save_models(models, store_dir, features, results, fingerprint, years=None, thresholds=None, **params):
+    """
+    Save the models as a new version, with their feature order, metrics, training years, outlier thresholds
+    (prepare_training_data) and training data fingerprint
+    """
+    versions = store_versions(store_dir)
+    version = f"v{int(versions[-1][1:]) + 1 if versions else 1}"
+    path = os.path.join(store_dir, version)
+    os.makedirs(path)
+    with open(os.path.join(path, 'emission_models.pkl'), 'wb') as f:
+        pickle.dump(models, f)
+    metadata = {
+        'version': version,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'fingerprint': fingerprint,
+        'features': list(features),
+        'years': sorted(int(year) for year in years) if years is not None else None,
+        'outlier_thresholds': thresholds,
+        'metrics': {label: {'r2': float(r2), 'rmse': float(rmse)} for label, (r2, rmse) in results.items()},
+        'params': params,
+        'sklearn_version': lazy_import('sklearn').__version__,
+    }
+    with open(os.path.join(path, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent=2, default=str)
+    print(f"Saved models to {path}")
+    return version
+
+
+def load_models(store_dir, version=None, fingerprint=None):
+    """
+    Load (models, metadata) for a version (latest if None). With a fingerprint, only a version trained
+    on exactly that data counts; returns None when there is no match.
+    """
+    versions = store_versions(store_dir)
+    if version is not None:
+        versions = [v for v in versions if v == version]
+    for candidate in reversed(versions):
+        metadata = read_metadata(store_dir, candidate)
+        if fingerprint is not None and metadata['fingerprint'] != fingerprint:
+            continue
+        lazy_import('sklearn.ensemble')  # unpickling the models imports sklearn, count it as startup
+        with open(os.path.join(store_dir, candidate, 'emission_models.pkl'), 'rb') as f:
+            return pickle.load(f), metadata
+    return None
+
+
+def train_or_load_models(X, targets, store_dir, mode='separate', n_jobs=-1, n_estimators=100, random_state=42, backend='random_forest',
+                         thresholds=None):
+    """
+    Same as train_models, but skip training when the store already has models for this exact
+    training data and parameters. thresholds are the outlier cutoffs X was prepared with, saved so
+    refresh_models can prepare the same rows again. Returns (models, results, predictions, metadata).
+    """
+    params = {'mode': mode, 'n_estimators': n_estimators, 'random_state': random_state}
+    if backend != 'random_forest':
+        params['backend'] = backend  # forests keep the fingerprint they were stored with
+    fingerprint = training_fingerprint(X, targets, **params)
+    stored = load_models(store_dir, fingerprint=fingerprint)
+    if stored is not None:
+        models, metadata = stored
+        print(f"Training data unchanged, using stored models {metadata['version']}")
+        _, X_test, _, Y_test = split_data(X, targets, random_state=random_state)
+        results, predictions = evaluate_models(models, X_test, Y_test)
+        return models, results, predictions, metadata
+
+    models, results, predictions = train_models(X, targets, mode=mode, n_jobs=n_jobs, n_estimators=n_estimators,
+                                                random_state=random_state, backend=backend)
+    save_models(models, store_dir, X.columns, results, fingerprint, years=X['year'].unique(), thresholds=thresholds, **params)
+    return models, results, predictions, load_models(store_dir, fingerprint=fingerprint)[1]
+
+
+########## INCREMENTAL REFRESH ##########
+
+def size_param(estimator):
+    """Name of the parameter that sets how many trees (forest) or boosting iterations an estimator has"""
+    return 'max_iter' if 'max_iter' in estimator.get_params() else 'n_estimators'
+
+
+def grow_models(models, X_new, Y_new, extra_estimators):
+    """Warm start: keep the fitted trees/iterations and fit extra_estimators more on the new rows only"""
+    fitted = set()
+    for label, model in models.items():
+        estimator = model.estimator if isinstance(model, TargetColumn) else model
+        if id(estimator) in fitted:  # a multi-output forest is shared by every pollutant
+            continue
+        param = size_param(estimator)
+        estimator.set_params(warm_start=True, **{param: estimator.get_params()[param] + extra_estimators})
+        estimator.fit(X_new, Y_new.values if isinstance(model, TargetColumn) else Y_new[label])
+        fitted.add(id(estimator))
+    return models
+
+
+def drift(models, metadata, X_test, Y_test):
+    """Relative RMSE increase of every stored model on new data vs its stored test RMSE"""
+    results, _ = evaluate_models(models, X_test, Y_test)
+    return {label: float(rmse / metadata['metrics'][label]['rmse'] - 1) for label, (r2, rmse) in results.items()}
+
+
+def refresh_models(final_df, store_dir, mode='separate', n_jobs=-1, n_estimators=100, random_state=42,
+                   backend='random_forest', extra_estimators=25, drift_threshold=0.15):
+    """
+    Incremental version of train_or_load_models for when new years are added to the combined EIA table.
+    The training data is prepared with the outlier thresholds stored with the latest models (new years don't move
+    the cutoffs of the old ones), and those models (same mode, backend and features) are checked on a held-out
+    slice of the new years: if no RMSE grew by more than drift_threshold, they grow extra_estimators
+    trees/iterations on the new years' training slice (warm start) and are re-evaluated on the held-out slices
+    of the old and new years. Anything else (no stored models, no new years, old years changed, drift) falls
+    back to a full retrain. Warm-started models are fingerprinted with warm_start=True, so train_or_load_models
+    never loads them in place of a full retrain. Returns (models, results, predictions, metadata).
+    """
+    params = {'mode': mode, 'n_estimators': n_estimators, 'random_state': random_state}
+    if backend != 'random_forest':
+        params['backend'] = backend
+    X, targets, thresholds = prepare_training_data(final_df, return_thresholds=True)
+    full_retrain = lambda: train_or_load_models(X, targets, store_dir, mode=mode, n_jobs=n_jobs, n_estimators=n_estimators,
+                                               random_state=random_state, backend=backend, thresholds=thresholds)
+    if load_models(store_dir, fingerprint=training_fingerprint(X, targets, **params)) is not None:
+        return full_retrain()  # loads the stored models
+
+    stored = load_models(store_dir)
+    if stored is None:
+        return full_retrain()
+    models, metadata = stored
+    stored_params = metadata['params']
+    stored_years = metadata.get('years')
+    stored_thresholds = metadata.get('outlier_thresholds')
+    if stored_years is None or stored_thresholds is None:
+        print("Stored models have no training years or outlier thresholds, full retrain")
+        return full_retrain()
+
+    X_refresh, targets_refresh = prepare_training_data(final_df, thresholds=stored_thresholds)
+    refresh_params = dict(params, warm_start=True)
+    fingerprint = training_fingerprint(X_refresh, targets_refresh, **refresh_params)
+    refreshed = load_models(store_dir, fingerprint=fingerprint)
+    if refreshed is not None:
+        models, metadata = refreshed
+        print(f"Training data unchanged, using refreshed models {metadata['version']}")
+        _, X_test, _, Y_test = split_data(X_refresh, targets_refresh, random_state=random_state)
+        results, predictions = evaluate_models(models, X_test, Y_test)
+        return models, results, predictions, metadata
+
+    if (metadata['features'] != list(X_refresh.columns)
+            or stored_params.get('mode') != mode or stored_params.get('backend', 'random_forest') != backend):
+        print("Stored models don't match this training setup, full retrain")
+        return full_retrain()
+
+    Y = pd.DataFrame(targets_refresh)
+    is_old = X_refresh['year'].isin(stored_years)
+    new_years = sorted(int(year) for year in X_refresh.loc[~is_old, 'year'].unique())
+    if not new_years:
+        print("No new years, but the training data changed: full retrain")
+        return full_retrain()
+    # the old years must be exactly what the stored models were trained on, or their split below isn't held out
+    old_params = {key: value for key, value in stored_params.items() if key in ('mode', 'n_estimators', 'random_state', 'backend', 'warm_start')}
+    old_targets = {label: y[is_old] for label, y in targets_refresh.items()}
+    if training_fingerprint(X_refresh[is_old], old_targets, **old_params) != metadata['fingerprint']:
+        print("Training data for the stored years changed: full retrain")
+        return full_retrain()
+
+    _, X_old_test, _, Y_old_test = split_data(X_refresh[is_old], Y[is_old], random_state=random_state)
+    X_new_train, X_new_test, Y_new_train, Y_new_test = split_data(X_refresh[~is_old], Y[~is_old], random_state=random_state)
+    drifts = drift(models, metadata, X_new_test, Y_new_test)
+    print("RMSE drift on new years " + ', '.join(f"{label} {value:+.1%}" for label, value in drifts.items()))
+    if max(drifts.values()) > drift_threshold:
+        print(f"Drift above {drift_threshold:.0%}: full retrain")
+        return full_retrain()
+
+    print(f"Warm start: {extra_estimators} more trees/iterations per model on {len(X_new_train):,} rows of {new_years}")
+    models = grow_models(models, X_new_train, Y_new_train, extra_estimators)
+    results, predictions = evaluate_models(models, pd.concat([X_old_test, X_new_test]), pd.concat([Y_old_test, Y_new_test]))
+    save_models(models, store_dir, X_refresh.columns, results, fingerprint, years=X_refresh['year'].unique(), thresholds=stored_thresholds,
+                refreshed_from=metadata['version'], added_years=new_years, added_estimators=extra_estimators, **refresh_params)
+    return models, results, predictions, load_models(store_dir, fingerprint=fingerprint)[1]
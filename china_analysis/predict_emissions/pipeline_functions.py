@@ -0,0 +1,169 @@
+"""
+Pipeline functions: run named stages in order with cached outputs (checkpoints)
+
+Every stage gets a key made from its settings, the size/mtime of its input files and the key of the
+stage it takes its input from (by default the stage before it). A stage whose checkpoint has the same key is skipped (its output is only read from
+disk if a later stage needs it), so changing a setting or an input file reruns that stage and
+everything after it, and any single stage can be run on its own from the checkpoints before it.
+"""
+
+import os
+import json
+import time
+import pickle
+import hashlib
+from datetime import datetime
+from startup_functions import total_startup
+
+
+class Stage:
+    """
+    A named pipeline step. func(config, engine, previous_output) returns the stage output.
+    params: config keys the output depends on
+    inputs: function(config) -> file paths the output depends on
+    exists: function(config, engine) -> False when the stage's side effects are gone (table dropped, files deleted)
+    upstream: name of the stage whose output it takes (default: the stage before it)
+    """
+
+    def __init__(self, name, func, params=(), inputs=None, exists=None, upstream=None):
+        self.name = name
+        self.func = func
+        self.params = list(params)
+        self.inputs = inputs
+        self.exists = exists
+        self.upstream = upstream
+
+
+def file_signatures(paths):
+    """(path, size, mtime) of each input file, missing files included so they still change the key"""
+    signatures = []
+    for path in sorted(paths):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signatures.append([path, stat.st_size, stat.st_mtime])
+        else:
+            signatures.append([path, None, None])
+    return signatures
+
+
+def stage_key(stage, config, upstream_key):
+    """sha256 over the stage name, its settings, its input files and the previous stage's key"""
+    payload = {
+        'stage': stage.name,
+        'params': {name: config.get(name) for name in stage.params},
+        'inputs': file_signatures(stage.inputs(config)) if stage.inputs else [],
+        'upstream': upstream_key,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class CheckpointStore:
+    """Stage outputs as {name}.pkl with a {name}.json holding the key they were made with"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def paths(self, name):
+        return os.path.join(self.directory, f'{name}.pkl'), os.path.join(self.directory, f'{name}.json')
+
+    def info(self, name):
+        output_path, info_path = self.paths(name)
+        if not (os.path.exists(output_path) and os.path.exists(info_path)):
+            return None
+        with open(info_path) as f:
+            return json.load(f)
+
+    def is_valid(self, name, key):
+        info = self.info(name)
+        return info is not None and info['key'] == key
+
+    def load(self, name):
+        with open(self.paths(name)[0], 'rb') as f:
+            return pickle.load(f)
+
+    def save(self, name, key, output, seconds, startup_seconds=0):
+        os.makedirs(self.directory, exist_ok=True)
+        output_path, info_path = self.paths(name)
+        # write to temp files first, so a crash mid-write never leaves a checkpoint that looks valid
+        with open(output_path + '.tmp', 'wb') as f:
+            pickle.dump(output, f)
+        with open(info_path + '.tmp', 'w') as f:
+            json.dump({'key': key, 'created_at': datetime.now().isoformat(timespec='seconds'), 'seconds': round(seconds, 2),
+                       'startup_seconds': round(startup_seconds, 2)}, f, indent=2)
+        os.replace(output_path + '.tmp', output_path)
+        os.replace(info_path + '.tmp', info_path)
+
+
+def upstream_names(stages):
+    """{stage: the stage whose output it takes}; by default the stage before it"""
+    names = [stage.name for stage in stages]
+    upstream = {}
+    for i, stage in enumerate(stages):
+        upstream[stage.name] = stage.upstream if stage.upstream is not None else (names[i - 1] if i > 0 else None)
+        if upstream[stage.name] is not None and upstream[stage.name] not in names[:i]:
+            raise ValueError(f"Stage '{stage.name}' takes its input from '{upstream[stage.name]}', which is not an earlier stage")
+    return upstream
+
+
+def stage_status(stages, config, engine, store):
+    """[(name, key, valid)] for every stage, a stale stage makes every stage downstream of it stale too"""
+    upstream = upstream_names(stages)
+    keys = {}
+    valid = {}
+    for stage in stages:
+        parent = upstream[stage.name]
+        keys[stage.name] = stage_key(stage, config, keys.get(parent))
+        valid[stage.name] = (
+            (parent is None or valid[parent])
+            and store.is_valid(stage.name, keys[stage.name])
+            and (stage.exists is None or stage.exists(config, engine))
+        )
+    return [(stage.name, keys[stage.name], valid[stage.name]) for stage in stages]
+
+
+def run_pipeline(stages, config, engine, checkpoint_dir='checkpoints', only=None, start=None, force=False):
+    """
+    Run the stages in order.
+    only:  run just this stage (the stages it depends on come from their checkpoints, or run if those are stale)
+    start: rerun this stage and every stage after it
+    force: ignore every checkpoint
+    """
+    names = [stage.name for stage in stages]
+    for name in (only, start):
+        if name is not None and name not in names:
+            raise ValueError(f"Unknown stage '{name}', choose from {names}")
+    upstream = upstream_names(stages)
+    store = CheckpointStore(checkpoint_dir)
+    status = {name: (key, valid) for name, key, valid in stage_status(stages, config, engine, store)}
+
+    selected = names
+    if only:
+        selected = [only]
+        while upstream[selected[0]] is not None:
+            selected.insert(0, upstream[selected[0]])
+    forced = {only} if only else (set(names[names.index(start):]) if start else set())
+
+    outputs = {}  # outputs of the stages run so far; anything else is read from its checkpoint when needed
+    rerun = set()
+    for stage in stages:
+        name = stage.name
+        if name not in selected:
+            continue
+        key, valid = status[name]
+        parent = upstream[name]
+        if valid and not force and name not in forced and parent not in rerun:
+            print(f"--- {name}: checkpoint is up to date, skipped")
+            continue
+        if parent is not None and parent not in outputs:
+            outputs[parent] = store.load(parent)
+        print(f"==> {name}")
+        started = time.perf_counter()
+        startup_before = total_startup()
+        outputs[name] = stage.func(config, engine, outputs.get(parent))
+        seconds = time.perf_counter() - started
+        # time spent importing heavy libraries / starting Spark inside the stage (see startup_functions.py)
+        startup = total_startup() - startup_before
+        store.save(name, key, outputs[name], seconds, startup)
+        rerun.add(name)
+        print(f"<== {name} done in {seconds:.1f} s ({startup:.1f} s startup, {seconds - startup:.1f} s compute)")
+    return outputs.get(selected[-1])
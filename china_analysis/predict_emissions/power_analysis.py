@@ -11,475 +11,305 @@ DATE: 08/08/2025
 ###################
 ### LIBRARIES ###
 import pandas as pd
-import numpy as np
-from sklearn.model_selection import train_test_split
 import os
-import sqlalchemy
-from sqlalchemy import create_engine
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import sum as spark_sum, collect_set, concat_ws
-from pyspark.sql.functions import split, explode, trim
-import matplotlib.pyplot as plt
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error, r2_score
-import matplotlib.ticker as ticker
-from sqlalchemy import text
-### DATA BASES ###
-spark = SparkSession.builder.appName("EmissionsAggregation").getOrCreate()
-engine = create_engine('sqlite:///power_plant_data.db')
-directory = 'C:/Users/wikku/portfolio/bu_gci/machine_learn_power'  #USED ONLY FOR EIA EXCEL SHEETS ON EMISSIONS
-########################################### LOAD DATA ########################################################################################################
-df = pd.read_excel('C:/Users/wikku/portfolio/bu_gci/chinese_power_plant.xlsx') #given data
-
-df['Technology'] = df['Technology'].str.lower() #standardize names
-#unique id
-df['id'] = df.index + 1
-carbon = pd.read_excel('C:/Users/wikku/portfolio/bu_gci/co2_all_country.xlsx') #our world in data
-nox_sulfur = pd.read_excel('C:/Users/wikku/portfolio/bu_gci/nitrogen_sulfur_all_country.xlsx') #our world in data
-
-#SQL
-df.to_sql('power_plant', con=engine, if_exists='replace', index=False)
-carbon.to_sql('carbon_accounting', con=engine, if_exists='replace', index=False)
-nox_sulfur.to_sql('nox_sulfur', con=engine, if_exists='replace', index=False)
-
-
-files = sorted([f for f in os.listdir(directory) if f.endswith('.xlsx') and not f.startswith('~$')]) #for reading in multiple excel files from eia.gov
-
-'''   
-The following section reads multiple Excel files found from eia.gov containing emissions data for different pollutants,
-takes the relevant columns, groups by year
-
-'''
-pollutants = {
-    'CO2': 'Metric Tonnes of CO2 Emissions',
-    'SO2': 'Selected SO2 Emissions (Metric Tonnes)',
-    'NOx': 'Selected NOx Emissions (Metric Tonnes)'
+import argparse
+from sqlalchemy import inspect
+from ingest_functions import load_emissions, load_emissions_incremental, replace_table_if_changed
+from combine_functions import combine_emissions
+from model_functions import prepare_training_data, train_or_load_models, refresh_models, load_models
+from predict_functions import stream_predictions, PredictionCache, plant_query
+from report_functions import load_comparison, comparison_query, country_year_aggregates, render_reports, render_pdf_report
+from storage_functions import create_sqlite_engine, replace_table, print_query_plans
+from pipeline_functions import Stage, run_pipeline, stage_status, CheckpointStore
+from scenario_functions import scenario_grid, run_scenarios, grid_cols
+from startup_functions import lazy_import, report_startup
+
+### SETTINGS ###
+config = {
+    'database': 'power_plant_data.db', #WAL + pragmas, typed tables and indexes in storage_functions.py
+    'directory': 'C:/Users/wikku/portfolio/bu_gci/machine_learn_power', #USED ONLY FOR EIA EXCEL SHEETS ON EMISSIONS
+    'power_plant_file': 'C:/Users/wikku/portfolio/bu_gci/chinese_power_plant.xlsx',
+    'carbon_file': 'C:/Users/wikku/portfolio/bu_gci/co2_all_country.xlsx', #our world in data
+    'nox_sulfur_file': 'C:/Users/wikku/portfolio/bu_gci/nitrogen_sulfur_all_country.xlsx', #our world in data
+    'incremental': True, #only load new or changed excel files into the database, False rebuilds every table
+    'ingest_workers': int(os.environ.get('EIA_WORKERS', os.cpu_count() or 1)), #processes used to parse the EIA workbooks, set EIA_WORKERS=1 to parse serially
+    'combine_backend': 'auto', #'pandas' runs in-process, 'spark' uses a SparkSession, 'auto' picks by input size
+    'spark_threshold_mb': 2048, #'auto' only starts Spark when the EIA tables take at least this much memory
+    'train_mode': 'separate', #'separate' = a forest per pollutant, 'multioutput' = one forest for all three
+    'train_jobs': -1, #cores used to build the trees, -1 = all of them
+    'model_backend': 'random_forest', #'random_forest' or 'hist_gradient_boosting' (much faster to fit and smaller to store on big data, see benchmark_models.py)
+    'train_refresh': 'warm_start', #when a new year arrives: 'warm_start' grows the stored models on it, 'full' always retrains on every year
+    'refresh_extra_estimators': 25, #trees (or boosting iterations) added per model by a warm start
+    'refresh_drift_threshold': 0.15, #retrain fully when a stored model's RMSE on the new year is this much above its stored RMSE
+    'show_training_plots': True, #actual vs predicted and feature importance plots after training
+    'model_dir': 'model_store', #versioned models + metadata.json (features, metrics, training data fingerprint)
+    'future_years': (1995, 2040), #predict from 1995 up to (not including) 2040
+    'predict_chunk_rows': 500_000, #plant-year rows predicted and written at a time
+    'scenario_capacity_factors': [1.0, 0.8, 0.6, 0.4], #share of the 8760 hours a year a plant runs at full load (the predictions above assume 1.0)
+    'scenario_year_ranges': [(1995, 2040)], #(first year, year after the last)
+    'scenario_fuel_assignments': {'as_reported': {}, 'coal_to_gas': {'coal': 'gas'}}, #{name: {technology: fuel}}, '*' = every technology
+    'scenario_chunk_rows': 2_000_000, #scenario plant-year rows predicted at a time
+    'report_dir': 'emissions_charts', #where the country charts are written
+    'report_format': 'png', #'png' or 'pdf' = a file per chart, 'report' = one multi-page pdf
+    'report_workers': os.cpu_count() or 1, #processes used to draw the charts
+    'explain_queries': True, #print EXPLAIN QUERY PLAN for the pipeline's queries, to check they use the indexes
+    'checkpoint_dir': 'checkpoints', #stage outputs + the key they were made with (see pipeline_functions.py)
 }
-id_cols = ['Plant Code', 'Aggregated Fuel Group', 'Generation (kWh)', 'Year']
-pollutant_dfs = {}
 
-for pollutant, emission_col in pollutants.items():
-    all_years = []
-    
-    for file in files:
-        filepath = os.path.join(directory, file)
-        year = int(file.replace('emissions', '').replace('.xlsx', ''))
+model_names = {'random_forest': 'Random Forest', 'hist_gradient_boosting': 'Gradient Boosting'}
 
-        try:
-            df = pd.read_excel(filepath, sheet_name=pollutant, skiprows=1)
-            df.columns = [col.strip() for col in df.columns]  # Remove whitespace
-            df['Year'] = year
+def read_power_plants(path):
+    df = pd.read_excel(path) #given data
+    df['Technology'] = df['Technology'].str.lower() #standardize names
+    #unique id
+    df['id'] = df.index + 1
+    return df
 
-            # Drop non-numeric Plant Codes (footnotes, etc.)
-            df = df[pd.to_numeric(df['Plant Code'], errors='coerce').notna()]
-            df['Plant Code'] = df['Plant Code'].astype(int)
+def eia_files(config):
+    if not os.path.isdir(config['directory']):
+        return []
+    return sorted([f for f in os.listdir(config['directory']) if f.endswith('.xlsx') and not f.startswith('~$')]) #for reading in multiple excel files from eia.gov
 
-            # Keep only relevant columns
-            df = df[['Plant Code', 'Aggregated Fuel Group', 'Generation (kWh)', 'Year', emission_col]].copy()
-            df = df.rename(columns={emission_col: f'{pollutant.lower()}_emissions'})
+def load_inputs(config):
+    return [config['power_plant_file'], config['carbon_file'], config['nox_sulfur_file']] + [os.path.join(config['directory'], f) for f in eia_files(config)]
 
-            #group by plant, year, and fuel group. In the original dataset, the plants were split up by other factors than just their fuel group.
-            #those other factors, like "prime mover" wont matter in the Chinese dataset, so we can just group by the plant, observation year, and observation fuel group (some plants had multiple)
-            df = df.groupby(['Plant Code', 'Aggregated Fuel Group', 'Year'], as_index=False).sum()
+def tables_exist(*tables):
+    def check(config, engine):
+        existing = set(inspect(engine).get_table_names())
+        return all(table in existing for table in tables)
+    return check
 
-            all_years.append(df)
+def reports_exist(config, engine):
+    return os.path.isdir(config['report_dir']) and len(os.listdir(config['report_dir'])) > 0
 
-        except Exception as e:
-            print(f"Error reading {pollutant} from {file}: {e}")
+def models_exist(config, engine):
+    #the train checkpoint only holds the metadata, the models themselves are in the model store
+    version = CheckpointStore(config['checkpoint_dir']).load('train')['version']
+    return os.path.exists(os.path.join(config['model_dir'], version, 'emission_models.pkl'))
 
-    # Combine all years and store
-    pollutant_dfs[pollutant] = pd.concat(all_years, ignore_index=True)
+def load_trained_models(config, model_metadata):
+    stored = load_models(config['model_dir'], version=model_metadata['version'])
+    if stored is None:
+        raise FileNotFoundError(f"Models {model_metadata['version']} are not in {config['model_dir']}, rerun training with --from train")
+    return stored
 
-#Store in sql
-for pollutant, df in pollutant_dfs.items():
-    df.to_sql(f'{pollutant.lower()}_emissions', con = engine, if_exists='replace', index=False)
+########################################### LOAD DATA ########################################################################################################
+def load_stage(config, engine, _):
+    incremental = config['incremental']
+    #SQL
+    #each table is only reloaded when its excel file changed since the last run (tracked in the ingest_log table)
+    replace_table_if_changed(engine, 'power_plant', config['power_plant_file'], read_power_plants, force=not incremental)
+    replace_table_if_changed(engine, 'carbon_accounting', config['carbon_file'], pd.read_excel, force=not incremental) #our world in data
+    replace_table_if_changed(engine, 'nox_sulfur', config['nox_sulfur_file'], pd.read_excel, force=not incremental) #our world in data
+
+    directory = config['directory']
+    files = eia_files(config)
+
+    '''
+    The following section reads multiple Excel files found from eia.gov containing emissions data for different pollutants,
+    takes the relevant columns, groups by year
+
+    Each workbook is opened once for all three pollutant sheets (see ingest_functions.py), and the cleaned sheets are cached
+    as parquet files next to the workbooks, so reruns with unchanged workbooks skip the slow Excel parsing.
+    The workbooks are spread over a process pool (one workbook per task), then merged back in year order.
+
+    In incremental mode each workbook is one year partition of the {pollutant}_emissions tables: only new or changed
+    workbooks are parsed and written (delete that year, then insert), so adding emissions2024.xlsx costs one workbook.
+    '''
+    if incremental:
+        pollutant_dfs = load_emissions_incremental(engine, directory, files, workers=config['ingest_workers'])
+    else:
+        pollutant_dfs = load_emissions(directory, files, workers=config['ingest_workers'])
+        #Store in sql
+        for pollutant, df in pollutant_dfs.items():
+            replace_table(engine, f'{pollutant.lower()}_emissions', df)
+    return pollutant_dfs
 
 ########################################### LOAD DATA DONE ###################################################################################################
 
-########################################### SPARK DATA FRAME #################################################################################################
-# SQL to Pandas to CSV to Spark DataFrame to Pandas Dataframe
-
-'''
-Why Spark? Why this convoluted process?
-1. SQL helped me join the dataframes together to bring the emissions data together.
-2. However, further aggregation was needed now that the emissions data comes together.
-3. Pandas could not handle the sheer size of the data, but Spark can. It's a great at scaling data processing tasks.
-4. Bringing Pandas directly to Spark is difficult, so I used a CSV as a middleman. Spark reads CSVs better, so create csv
-5. Finally, I convert the Spark DataFrame back to Pandas for machine learning model training.
-
-This pattern may not be the most efficient. In future, I will consider doing the SQL join directly in Spark or using PySpark for the entire process. However, this method gets the job done.
-(it was also nice to have the csv file, that way I could skip beginning steps)
-
-'''
-
-#SQL to join emissions dataframes of CO2, SO2, and NOx
-query = """
-SELECT 
-    co2."Plant Code" AS plant_id,
-    co2."Aggregated Fuel Group",
-    co2."Generation (kWh)",
-    co2."Year",
-    co2.CO2_emissions,
-    so2.SO2_emissions,
-    nox.NOx_emissions
-FROM co2_emissions co2
-LEFT JOIN so2_emissions so2
-    ON co2."Plant Code" = so2."Plant Code" AND co2."Year" = so2."Year"
-LEFT JOIN nox_emissions nox
-    ON co2."Plant Code" = nox."Plant Code" AND co2."Year" = nox."Year"
-"""
-#SQL to pandas, just something I'm used to
-combined_df = pd.read_sql_query(query, con = engine)
-
-#pandas to csv, so I can read it into spark. Certainly a middleman step, but it works
-combined_df.to_csv('all_emissions_combined.csv', index=False) #THIS WILL CREATE A 2+ GB CSV FILE, MAKE SURE YOU HAVE ENOUGH SPACE - sorry
-#Spark read csv, so I can do aggregations with a large dataset
-spark_df = spark.read.csv('all_emissions_combined.csv', header=True, inferSchema=True)
-#aggregations
-#why aggregate? If you look at the dataset that joined the emissions data, you will see that the data set is "taking turns" with the emissions data.
-#For example, when the data has values for CO2 emissions, it does not have values for SO2 or NOx emissions. When it has values for SO2 emissions, it does not have values for CO2 or NOx emissions. ETC.
-#So, I need to aggregate the data by plant and year, so that I can have a single row for each plant and year, with the emissions data on CO2, SO2, and NOx for that plant and year.
-collapsed_df = (
-    spark_df.groupBy("plant_id", "Year")
-    .agg(
-        spark_sum("Generation (kWh)").alias("generation_kwh"),
-        spark_sum("CO2_emissions").alias("co2_emissions"),
-        spark_sum("SO2_emissions").alias("so2_emissions"),
-        spark_sum("NOx_emissions").alias("nox_emissions"),
-        concat_ws(",", collect_set("Aggregated Fuel Group")).alias("fuel_group")
-    )
-)
-#split by fuel group, so that each fuel group is its own row, which will repeat plants and years
-#while not ideal, this says that the gas part of the plant produces the same emissions as the coal part of the plant, which is not true, but it is a good enough approximation for this analysis
-exploded_df = (
-    collapsed_df
-    .withColumn("fuel_group", explode(split("fuel_group", ",")))
-    .withColumn("fuel_group", trim("fuel_group"))
-)
-#back to Pandas -> used for machine learning model
-final_df = exploded_df.toPandas()
-########################################### SPARK DATA FRAME DONE ############################################################################################
+########################################### COMBINE EMISSIONS ################################################################################################
+def combine_stage(config, engine, pollutant_dfs):
+    '''
+    This used to be SQL join -> pandas -> 2+ GB csv -> Spark -> pandas, because pandas could not hold the joined table.
+    The join only matched on plant and year, so a plant with k fuel groups got k^3 rows, and the data was "taking turns"
+    until it was collapsed by plant and year and split back out by fuel group (giving every fuel group the whole plant's emissions).
+
+    combine_functions.py now lines the CO2, SO2 and NOx tables up on plant, year AND fuel group, so there is one row
+    per (plant, year, fuel group) and each fuel group keeps its own emissions. It prints the row counts in and out as a
+    fan-out guard. by_fuel_group=False brings back the old plant and year collapse.
+    - 'pandas' (default): in-process, no csv is written
+    - 'spark': the same combine on a SparkSession, built straight from the pandas dataframes
+    - 'auto': Spark only when the tables are bigger than spark_threshold_mb (the JVM takes seconds to start)
+    '''
+    return combine_emissions(pollutant_dfs, backend=config['combine_backend'], by_fuel_group=True, spark_threshold_mb=config['spark_threshold_mb'])
+########################################### COMBINE EMISSIONS DONE ###########################################################################################
 ########################################### MACHINE LEARNING MODEL ###########################################################################################
-# turn generation_kwh to mwh
-final_df['generation_mwh'] = final_df['generation_kwh'] / 1000
-#drop kwh
-final_df = final_df.drop(columns=['generation_kwh'])
-#change names of the fuel groups PET turn to oil, GAS to gas, and COAL to coal
-final_df['fuel_group'] = final_df['fuel_group'].replace({
-    'PET': 'oil',
-    'GAS': 'gas',
-    'COAL': 'coal'
-})
-final_df = final_df[~final_df['fuel_group'].isin(['MSW', 'GEO'])] #only wanted to focus on coal, gas, and oil
-
-final_df = final_df.dropna() #not many nas, not a big deal
-#replace zeros if necessary to avoid log(0)
-final_df = final_df[
-    (final_df['co2_emissions'] > 0) &
-    (final_df['so2_emissions'] > 0) &
-    (final_df['nox_emissions'] > 0)
-]
-final_df['log_co2'] = np.log(final_df['co2_emissions']) #will standardize
-final_df['log_so2'] = np.log(final_df['so2_emissions'])
-final_df['log_nox'] = np.log(final_df['nox_emissions'])
-
-#I belive there was a a "test" plant id 9999 that was a huge outlier, so this code will remove that and other possible outliers
-co2_thresh = final_df['co2_emissions'].quantile(0.99)
-so2_thresh = final_df['so2_emissions'].quantile(0.99)
-nox_thresh = final_df['nox_emissions'].quantile(0.99)
-
-#keep rows below the 99th percentile for all three
-final_df = final_df[
-    (final_df['co2_emissions'] <= co2_thresh) &
-    (final_df['so2_emissions'] <= so2_thresh) &
-    (final_df['nox_emissions'] <= nox_thresh)
-]
-final_df.rename(columns={'Year': 'year'}, inplace=True)  # Rename for consistency
-#machine learning models
-X = final_df[['generation_mwh', 'year', 'fuel_group']]
-X = pd.get_dummies(X, columns=['fuel_group'], drop_first=True)
-### Make a model for each emission type as the y ###
-y_co2 = final_df['log_co2']
-y_so2 = final_df['log_so2']
-y_nox = final_df['log_nox']
-
-
-'''
-The following code will autmoatically train a Random Forest model for each pollutant (CO2, SO2, NOx), three different models with each pollutant as the target variable.
-'''
-targets = {
-    'co2': y_co2,
-    'so2': y_so2,
-    'nox': y_nox
-}
-
-# Store results for each
-results = {}
-models = {} #store the models to apply to chinese power plant data
-
-for label, y in targets.items():
-    # Split
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-    # Model
-    model = RandomForestRegressor(n_estimators=100, random_state=42)
-    model.fit(X_train, y_train)
-    y_pred = model.predict(X_test)
-
-    # Evaluate
-    r2 = r2_score(y_test, y_pred)
-    rmse = mean_squared_error(y_test, y_pred, squared=False)
-    results[label] = (r2, rmse)
-    models[label] = model  # Store the model for later use
-
-    # Plot Actual vs Predicted
-    plt.figure(figsize=(10, 7))
-    plt.scatter(y_test, y_pred, alpha=0.5)
-    plt.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'r--')
-    plt.xlabel(f"Actual {label} Emissions")
-    plt.ylabel(f"Predicted {label} Emissions")
-    plt.title(f"Random Forest: Actual vs Predicted {label} Emissions")
-    plt.grid(True)
-    plt.tight_layout()
-    plt.show()
-    plt.close()
-
-    # Feature importances
-    importances = model.feature_importances_
-    feature_names = X.columns
-    sorted_idx = importances.argsort()
-
-    plt.figure(figsize=(8, 6))
-    plt.barh(range(len(importances)), importances[sorted_idx], align='center')
-    plt.yticks(range(len(importances)), [feature_names[i] for i in sorted_idx])
-    plt.title(f"{label} Model Feature Importance")
-    plt.tight_layout()
-    plt.show()
-    plt.close()
-
-# Print all results
-for label, (r2, rmse) in results.items():
-    print(f"{label} Model R²: {r2:.3f}")
-    print(f"{label} Model RMSE: {rmse:.2f}")
+def train_stage(config, engine, final_df):
+    #kWh -> MWh, coal/gas/oil only, log emissions, 99th percentile outliers removed, fuel group dummies (see model_functions.py)
+    X, targets, thresholds = prepare_training_data(final_df, return_thresholds=True)
+
+    '''
+    The following code will autmoatically train a model (Random Forest by default) for each pollutant (CO2, SO2, NOx), three different models with each pollutant as the target variable.
+    All three share X and the same train/test split (random_state=42), so the split is made once (see model_functions.py).
+    train_mode 'separate' keeps three forests but builds their trees on all cores, 'multioutput' fits one forest on all three targets.
+    '''
+    # results: (R², RMSE) for each, models: store the models to apply to chinese power plant data
+    #models are saved in the model store with their feature order and metrics; if the training data hasn't changed, the stored ones are used instead of retraining
+    #with train_refresh 'warm_start', a new EIA year only adds trees fitted on that year, unless the stored models have drifted (see refresh_models)
+    if config['train_refresh'] == 'warm_start':
+        models, results, predictions, model_metadata = refresh_models(final_df, config['model_dir'], mode=config['train_mode'], n_jobs=config['train_jobs'], backend=config['model_backend'],
+                                                                      extra_estimators=config['refresh_extra_estimators'], drift_threshold=config['refresh_drift_threshold'])
+    else:
+        models, results, predictions, model_metadata = train_or_load_models(X, targets, config['model_dir'], mode=config['train_mode'], n_jobs=config['train_jobs'], backend=config['model_backend'],
+                                                                            thresholds=thresholds)
+
+    for label, (y_test, y_pred) in predictions.items():
+        if not config['show_training_plots']:
+            break
+        plt = lazy_import('matplotlib.pyplot') #only imported when the plots are shown
+        model = models[label]
+
+        # Plot Actual vs Predicted
+        plt.figure(figsize=(10, 7))
+        plt.scatter(y_test, y_pred, alpha=0.5)
+        plt.plot([y_test.min(), y_test.max()], [y_test.min(), y_test.max()], 'r--')
+        plt.xlabel(f"Actual {label} Emissions")
+        plt.ylabel(f"Predicted {label} Emissions")
+        plt.title(f"{model_names[config['model_backend']]}: Actual vs Predicted {label} Emissions")
+        plt.grid(True)
+        plt.tight_layout()
+        plt.show()
+        plt.close()
+
+        # Feature importances (the boosting backend computes them here, on the test split, not when fitting)
+        if hasattr(model, 'set_importance_data'):
+            test_rows = y_test.index.intersection(X.index)
+            model.set_importance_data(X.loc[test_rows], y_test.loc[test_rows])
+        importances = model.feature_importances_
+        feature_names = model_metadata['features']
+        sorted_idx = importances.argsort()
+
+        plt.figure(figsize=(8, 6))
+        plt.barh(range(len(importances)), importances[sorted_idx], align='center')
+        plt.yticks(range(len(importances)), [feature_names[i] for i in sorted_idx])
+        plt.title(f"{label} Model Feature Importance")
+        plt.tight_layout()
+        plt.show()
+        plt.close()
+
+    # Print all results
+    for label, (r2, rmse) in results.items():
+        print(f"{label} Model R²: {r2:.3f}")
+        print(f"{label} Model RMSE: {rmse:.2f}")
+    #the models themselves are already in the model store, the checkpoint only records which version to use
+    return model_metadata
 ########################################### MACHINE LEARNING MODEL DONE ######################################################################################
 ########################################### APPLY MACHINE LEARNING MODEL TO CHINESE DATA #####################################################################
-query = """ SELECT id, "Capacity (MW)" AS mw, "Year of Commission" as year_commission, Technology AS technology, Country AS country FROM power_plant WHERE year_commission BETWEEN 1995 AND 2032"""
-chinese_power_df = pd.read_sql_query(query, con=engine) #read in the power plant data from the SQL database
-#turn year_commission to year
-chinese_power_df['year_commission'] = pd.to_datetime(chinese_power_df['year_commission'], format='%Y').dt.year
-chinese_power_df['mwh'] = chinese_power_df['mw'] * 8760 #convert MW to MWh, assuming running every hour of the year
-chinese_power_df = chinese_power_df.drop(columns=['mw']) #drop MW column, not needed anymore
-chinese_power_df = chinese_power_df[~chinese_power_df['technology'].isin(['hydropower', 'solar', 'wind', 'biomass', 'nuclear', 'geothermal', 'waste'])]  #i only focuses on coal, gas, and oil
-#Define target range -> I want to not only predict emissions for the years in the dataset, but also for future years, but i didn't want to go too far into the past either
-future_years = range(1995, 2040)
-
-#Expand the DataFrame
-df_expanded = (
-    chinese_power_df.assign(key=1)
-    .merge(pd.DataFrame({'year': future_years, 'key': 1}), on='key')
-    .query('year >= year_commission')  # Only keep rows where the plant exists call it 'Year' to align with model name
-    .drop(columns='key')
-)
-#align with model name
-df_expanded.rename(columns={'mwh': 'generation_mwh'}, inplace=True)
-df_expanded['fuel_group'] = df_expanded['technology'].str.lower()
-df_expanded['fuel_group_gas'] = (df_expanded['fuel_group'] == 'gas').astype(int)
-df_expanded['fuel_group_oil'] = (df_expanded['fuel_group'] == 'oil').astype(int)
-X_new = df_expanded[['generation_mwh', 'year', 'fuel_group_gas', 'fuel_group_oil']]
-df_expanded['Predicted_co2'] = models['co2'].predict(X_new)
-df_expanded['Predicted_so2'] = models['so2'].predict(X_new)
-df_expanded['Predicted_nox'] = models['nox'].predict(X_new)
-df_expanded.drop(columns=['fuel_group_gas', 'fuel_group_oil', 'fuel_group'], inplace=True)  # Clean up the DataFrame
-#Convert log predictions back to original scale
-df_expanded['pred_co2_emissions'] = np.exp(df_expanded['Predicted_co2'])
-df_expanded['pred_so2_emissions'] = np.exp(df_expanded['Predicted_so2'])
-df_expanded['pred_nox_emissions'] = np.exp(df_expanded['Predicted_nox'])
-df_expanded.to_sql('predicted_emissions', con=engine, if_exists='replace', index=False)# Store the predictions in SQL
+def predict_stage(config, engine, model_metadata):
+    '''
+    Each plant is predicted for every year from its commission year (plant x year expansion).
+    predict_functions.py streams this: plants are read a page at a time, expanded, predicted for all three pollutants
+    and appended to predicted_emissions, so memory stays flat however many plants there are.
+    Each chunk's country-year totals are added to predicted_emissions_country_year, which the report joins on.
+    '''
+    models, model_metadata = load_trained_models(config, model_metadata)
+    #Define target range -> I want to not only predict emissions for the years in the dataset, but also for future years, but i didn't want to go too far into the past either
+    future_years = range(*config['future_years'])
+    #plants with the same capacity, year and fuel have the same features: each unique one is predicted once, and kept on disk for the next run with these models
+    prediction_cache = PredictionCache(os.path.join(config['model_dir'], 'prediction_cache.pkl'), model_key=model_metadata['fingerprint'])
+    rows = stream_predictions(engine, models, model_metadata['features'], future_years, chunk_rows=config['predict_chunk_rows'], cache=prediction_cache) # Store the predictions in SQL
+    prediction_cache.save()
+    prediction_cache.report()
+    return {'predicted_rows': rows, 'model_version': model_metadata['version']}
 ########################################### APPLY MACHINE LEARNING MODEL TO CHINESE DATA DONE ################################################################
+########################################### SCENARIOS ##########################################################################################################
+def scenario_stage(config, engine, model_metadata):
+    '''
+    Sensitivity analysis: every combination of capacity factor, year range and fuel assignment (see scenario_functions.py).
+    All scenarios of a page of plants are stacked into one feature matrix and predicted in one call per model,
+    so a sweep over dozens of scenarios costs about as much as one prediction run. Results: scenario_emissions table.
+    '''
+    models, model_metadata = load_trained_models(config, model_metadata)
+    grid = scenario_grid(config['scenario_capacity_factors'], config['scenario_year_ranges'], config['scenario_fuel_assignments'])
+    prediction_cache = PredictionCache(os.path.join(config['model_dir'], 'prediction_cache.pkl'), model_key=model_metadata['fingerprint'])
+    results = run_scenarios(engine, models, model_metadata['features'], grid, config['scenario_fuel_assignments'],
+                            chunk_rows=config['scenario_chunk_rows'], cache=prediction_cache)
+    prediction_cache.save()
+    prediction_cache.report()
+    print(results.groupby(grid_cols)[['pred_co2_emissions', 'pred_so2_emissions', 'pred_nox_emissions']].sum())
+    return {'scenarios': len(grid), 'rows': len(results)}
+########################################### SCENARIOS DONE #####################################################################################################
 ########################################### CHINESE EMISSIONS AS A PROPORTION OF RECIPIENT COUNTRY'S EMISSIONS ###############################################
-query = """
-SELECT 
-    nox_sulfur.entity, 
-    nox_sulfur.year, 
-    "nitrogen_oxide" as "nox_emissions", 
-    "sulfur_dioxide" as "so2_emissions",
-    "annual_co2" as "annual_co2_emissions",
-    predicted_emissions.country,
-    predicted_emissions.year as pred_year,
-    predicted_emissions.pred_co2_emissions,
-    predicted_emissions.pred_so2_emissions,
-    predicted_emissions.pred_nox_emissions
-FROM nox_sulfur
-JOIN carbon_accounting 
-    ON nox_sulfur.entity = carbon_accounting.entity 
-    AND nox_sulfur.year = carbon_accounting.year
-JOIN predicted_emissions 
-    ON nox_sulfur.entity = predicted_emissions.country 
-    AND nox_sulfur.year = predicted_emissions.year
-"""
-nox_sulfur_carbon_df = pd.read_sql_query(query, con=engine)
-nox_sulfur_carbon_df['pred_co2_emissions'] = nox_sulfur_carbon_df['pred_co2_emissions'] / 1e6  # convert to million metric tons
-nox_sulfur_carbon_df['pred_so2_emissions'] = nox_sulfur_carbon_df['pred_so2_emissions'] / 1e3  # convert to thousand metric tons
-nox_sulfur_carbon_df['pred_nox_emissions'] = nox_sulfur_carbon_df['pred_nox_emissions'] / 1e3 # convert to thousand metric tons
-nox_sulfur_carbon_df['nox_emissions'] = nox_sulfur_carbon_df['nox_emissions'] / 1e3  # convert to thousand metric tons
-nox_sulfur_carbon_df['so2_emissions'] = nox_sulfur_carbon_df['so2_emissions'] / 1e3 # convert to thousand metric tons
-nox_sulfur_carbon_df['annual_co2_emissions'] = nox_sulfur_carbon_df['annual_co2_emissions'] / 1e6 # convert to million metric tons
-
-
-### PLOTTING ###
-
-## CO2 ##
-# Make sure year columns are numeric
-nox_sulfur_carbon_df['year'] = nox_sulfur_carbon_df['year'].astype(int)
-nox_sulfur_carbon_df['pred_year'] = nox_sulfur_carbon_df['pred_year'].astype(int)
-
-for country in sorted(nox_sulfur_carbon_df['country'].unique()):
-    country_df = nox_sulfur_carbon_df[nox_sulfur_carbon_df['country'] == country]
-
-    # years for THIS country only
-    years = sorted(country_df['year'].unique())
-
-    # annual actual totals
-    actual = (
-        country_df.groupby('year')['annual_co2_emissions']
-        .sum()
-        .reindex(years, fill_value=0)
-    )
-
-    # annual Chinese totals (no cumsum!)
-    predicted = (
-        country_df.groupby('pred_year')['pred_co2_emissions']
-        .sum()
-        .reindex(years, fill_value=0)
-    )
-
-    # optionally ensure the stack never goes negative
-    predicted = predicted.clip(upper=actual)
-
-    if predicted.sum() == 0 and actual.sum() == 0:
-        continue
-
-    other = actual - predicted
-
-    # --- Plot ---
-    plt.figure(figsize=(10, 5))
-    plt.bar(years, other, label='Other CO₂', color='gray')
-    plt.bar(years, predicted, bottom=other, label='Chinese Plants CO₂', color='red')
-
-    # % labels (light offset based on scale)
-    for x, tot, chi in zip(years, actual, predicted):
-        if tot > 0:
-            pct = 100 * chi / tot
-            if pct >= 1:
-                plt.text(x, tot * 1.01, f"{pct:.1f}%", ha='center', fontsize=8)
-
-    plt.title(f"CO₂ Emissions in {country} (Actual vs. Chinese Plants)")
-    plt.xlabel("Year")
-    plt.ylabel("CO₂ Emissions (million metric tons)")  # units match your scaling
-    plt.xticks(years, [str(y) for y in years], rotation=45)
-    plt.grid(axis='y', linestyle='--', alpha=0.6)
-    plt.legend()
-    plt.tight_layout()
-    plt.show()
-    plt.close()
-
-## SO2 ##
-for country in sorted(nox_sulfur_carbon_df['country'].unique()):
-    country_df = nox_sulfur_carbon_df[nox_sulfur_carbon_df['country'] == country]
-
-    # years for THIS country only
-    years = sorted(country_df['year'].unique())
-
-    # annual actual totals
-    actual = (
-        country_df.groupby('year')['so2_emissions']
-        .sum()
-        .reindex(years, fill_value=0)
-    )
-
-    # annual Chinese totals
-    predicted = (
-        country_df.groupby('pred_year')['pred_so2_emissions']
-        .sum()
-        .reindex(years, fill_value=0)
-    )
-
-    # optionally ensure the stack never goes negative
-    predicted = predicted.clip(upper=actual)
-
-    if predicted.sum() == 0 and actual.sum() == 0:
-        continue
-
-    other = actual - predicted
-
-    # --- Plot ---
-    plt.figure(figsize=(10, 5))
-    plt.bar(years, other, label='Other SO2', color='gray')
-    plt.bar(years, predicted, bottom=other, label='Chinese Plants SO2', color='red')
-
-    # % labels (light offset based on scale)
-    for x, tot, chi in zip(years, actual, predicted):
-        if tot > 0:
-            pct = 100 * chi / tot
-            if pct >= 1:
-                plt.text(x, tot * 1.01, f"{pct:.1f}%", ha='center', fontsize=8)
-
-    plt.title(f"SO2 Emissions in {country} (Actual vs. Chinese Plants)")
-    plt.xlabel("Year")
-    plt.ylabel("SO2 Emissions (thousand metric tons)")  # units match your scaling
-    plt.xticks(years, [str(y) for y in years], rotation=45)
-    plt.grid(axis='y', linestyle='--', alpha=0.6)
-    plt.legend()
-    plt.tight_layout()
-    plt.show()
-    plt.close()
-## NOx ##
-for country in sorted(nox_sulfur_carbon_df['country'].unique()):
-    country_df = nox_sulfur_carbon_df[nox_sulfur_carbon_df['country'] == country]
-
-    # years for THIS country only
-    years = sorted(country_df['year'].unique())
-
-    # annual actual totals
-    actual = (
-        country_df.groupby('year')['nox_emissions']
-        .sum()
-        .reindex(years, fill_value=0)
-    )
-
-    # annual Chinese totals
-    predicted = (
-        country_df.groupby('pred_year')['pred_nox_emissions']
-        .sum()
-        .reindex(years, fill_value=0)
-    )
-
-    # optionally ensure the stack never goes negative
-    predicted = predicted.clip(upper=actual)
-
-    if predicted.sum() == 0 and actual.sum() == 0:
-        continue
-
-    other = actual - predicted
-
-    # --- Plot ---
-    plt.figure(figsize=(10, 5))
-    plt.bar(years, other, label='Other NOx', color='gray')
-    plt.bar(years, predicted, bottom=other, label='Chinese Plants NOx', color='red')
-
-    # % labels (light offset based on scale)
-    for x, tot, chi in zip(years, actual, predicted):
-        if tot > 0:
-            pct = 100 * chi / tot
-            if pct >= 1:
-                plt.text(x, tot * 1.01, f"{pct:.1f}%", ha='center', fontsize=8)
-
-    plt.title(f"NOx Emissions in {country} (Actual vs. Chinese Plants)")
-    plt.xlabel("Year")
-    plt.ylabel("NOx Emissions (thousand metric tons)")  # units match your scaling
-    plt.xticks(years, [str(y) for y in years], rotation=45)
-    plt.grid(axis='y', linestyle='--', alpha=0.6)
-    plt.legend()
-    plt.tight_layout()
-    plt.show()
-    plt.close()
+def report_stage(config, engine, _):
+    nox_sulfur_carbon_df = load_comparison(engine) #actual and predicted emissions joined by country and year, in million (CO2) / thousand (SO2, NOx) metric tons
+    if config['explain_queries']:
+        print_query_plans(engine, {
+            'plant pages': (plant_query, {'last_id': 0, 'limit': 1000}),
+            'emissions year partition': 'SELECT * FROM co2_emissions WHERE "Year" = 2023',
+            'recipient country comparison': comparison_query,
+        })
+
+
+    ### PLOTTING ###
+    '''
+    CO2, SO2 and NOx charts for every country (see report_functions.py): the annual actual and Chinese totals come from one groupby
+    over country and year, and the charts are drawn without a window so they can be made in batch.
+    report_format 'png' or 'pdf' writes one file per country and pollutant (countries spread over report_workers processes),
+    'report' writes everything to one multi-page pdf.
+    '''
+    aggregates = country_year_aggregates(nox_sulfur_carbon_df)
+    report_dir = config['report_dir']
+    if config['report_format'] == 'report':
+        os.makedirs(report_dir, exist_ok=True)
+        path = os.path.join(report_dir, 'emissions_report.pdf')
+        render_pdf_report(aggregates, path)
+        return [path]
+    return render_reports(aggregates, report_dir, fmt=config['report_format'], workers=config['report_workers'])
+
+########################################### PIPELINE #########################################################################################################
+'''
+Every stage's output is checkpointed in checkpoint_dir with a key made from its settings, its input files and the stage before it,
+so a rerun skips the stages that are still up to date and any one stage can be run from the checkpoints before it.
+predict and report write to the database / chart folder, so their checkpoints only record what was written.
+    python power_analysis.py                  run the pipeline, skipping up to date stages
+    python power_analysis.py --stage report   only redraw the charts
+    python power_analysis.py --stage scenarios  only rerun the scenario sweep (it takes the trained models, not the predictions)
+    python power_analysis.py --from train     retrain and rerun everything after it
+    python power_analysis.py --force          ignore the checkpoints
+    python power_analysis.py --list           show which checkpoints are up to date
+'''
+stages = [
+    Stage('load', load_stage, params=['directory', 'incremental'], inputs=load_inputs,
+          exists=tables_exist('power_plant', 'carbon_accounting', 'nox_sulfur', 'co2_emissions', 'so2_emissions', 'nox_emissions')),
+    Stage('combine', combine_stage, params=['combine_backend', 'spark_threshold_mb']),
+    Stage('train', train_stage, params=['train_mode', 'model_backend', 'model_dir', 'train_refresh', 'refresh_extra_estimators', 'refresh_drift_threshold'], exists=models_exist),
+    Stage('predict', predict_stage, params=['future_years', 'model_dir'], exists=tables_exist('predicted_emissions', 'predicted_emissions_country_year')),
+    Stage('report', report_stage, params=['report_dir', 'report_format'], exists=reports_exist),
+    Stage('scenarios', scenario_stage, upstream='train', exists=tables_exist('scenario_emissions'),
+          params=['model_dir', 'scenario_capacity_factors', 'scenario_year_ranges', 'scenario_fuel_assignments']),
+]
+
+## MAIN WORKFLOW ##
+def main():
+    names = [stage.name for stage in stages]
+    parser = argparse.ArgumentParser(description="China power plant emissions pipeline")
+    parser.add_argument('--stage', choices=names, help="run only this stage, upstream stages come from their checkpoints")
+    parser.add_argument('--from', dest='start', choices=names, help="rerun this stage and every stage after it")
+    parser.add_argument('--force', action='store_true', help="ignore the checkpoints and rerun every stage")
+    parser.add_argument('--list', action='store_true', help="show the stages and whether their checkpoints are up to date")
+    args = parser.parse_args()
+
+    ### DATA BASES ###
+    engine = create_sqlite_engine(config['database'])
+    if args.list:
+        store = CheckpointStore(config['checkpoint_dir'])
+        for name, key, valid in stage_status(stages, config, engine, store):
+            info = store.info(name)
+            made = f"made {info['created_at']} in {info['seconds']} s" if info else "no checkpoint"
+            print(f"{name:<10} {'up to date' if valid else 'stale':<10} {made}")
+        return
+    run_pipeline(stages, config, engine, checkpoint_dir=config['checkpoint_dir'], only=args.stage, start=args.start, force=args.force)
+    report_startup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Predict functions: apply the emissions models to the Chinese power plant data
+
+The plant x year expansion is streamed: plants are read from the database a page at a time,
+each page is expanded to plant-years, predicted for every pollutant and appended to
+predicted_emissions, so memory depends on the chunk size and not on the number of plants.
+
+The models only see (generation_mwh, year, fuel group), so many plant-years share the same features.
+PredictionCache predicts each unique feature tuple once and keeps the results in a bounded LRU cache
+that is saved to disk and reused by later runs and scenarios with the same models.
+
+predicted_emissions_country_year is a materialized country x year summary of predicted_emissions:
+every chunk's country-year sums are added to it as the chunk is written, and
+refresh_country_year_summary recomputes it for the countries whose predictions changed.
+"""
+
+import os
+import pickle
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, inspect
+from storage_functions import create_table, bulk_insert, create_indexes, schemas
+from dtype_functions import compact_dtypes, default_memory, memory
+
+plant_query = """
+SELECT id, "Capacity (MW)" AS mw, "Year of Commission" as year_commission, Technology AS technology, Country AS country
+FROM power_plant
+WHERE year_commission BETWEEN 1995 AND 2032 AND id > :last_id
+ORDER BY id
+LIMIT :limit
+"""
+summary_table = 'predicted_emissions_country_year'
+summary_cols = ['pred_co2_emissions', 'pred_so2_emissions', 'pred_nox_emissions']
+skip_technologies = ['hydropower', 'solar', 'wind', 'biomass', 'nuclear', 'geothermal', 'waste'] #only coal, gas, and oil
+hours_per_year = 8760
+
+
+def iter_plants(engine, chunk_size=10_000):
+    """Page through the power_plant table by id (each page's query finishes before the next one starts)"""
+    last_id = 0
+    while True:
+        chunk = pd.read_sql_query(text(plant_query), con=engine, params={'last_id': last_id, 'limit': chunk_size})
+        if chunk.empty:
+            return
+        last_id = int(chunk['id'].iloc[-1])
+        yield chunk
+
+
+def prepare_plants(chinese_power_df):
+    """Commission year, MWh per year and coal/gas/oil only"""
+    chinese_power_df = chinese_power_df.copy()
+    #turn year_commission to year
+    chinese_power_df['year_commission'] = pd.to_datetime(chinese_power_df['year_commission'], format='%Y').dt.year
+    chinese_power_df['mwh'] = chinese_power_df['mw'] * hours_per_year #convert MW to MWh, assuming running every hour of the year
+    chinese_power_df = chinese_power_df.drop(columns=['mw']) #drop MW column, not needed anymore
+    return chinese_power_df[~chinese_power_df['technology'].isin(skip_technologies)]
+
+
+def expand_plant_years(chinese_power_df, years):
+    """Cross join plants with years, keeping only years the plant exists (year >= year_commission)"""
+    years = np.asarray(years)
+    n_plants = len(chinese_power_df)
+    expanded = chinese_power_df.iloc[np.repeat(np.arange(n_plants), len(years))].reset_index(drop=True)
+    expanded['year'] = np.tile(years.astype(np.int32), n_plants)
+    expanded = expanded[expanded['year'] >= expanded['year_commission']].reset_index(drop=True)
+    #align with model name
+    return expanded.rename(columns={'mwh': 'generation_mwh'})
+
+
+def feature_matrix(df_expanded, features):
+    """Model features in training order; fuel_group_* dummies come from the technology column"""
+    fuel_group = df_expanded['technology'].str.lower()
+    X_new = pd.DataFrame(index=df_expanded.index)
+    for feature in features:
+        if feature.startswith('fuel_group_'):
+            X_new[feature] = (fuel_group == feature[len('fuel_group_'):]).astype(int)
+        else:
+            X_new[feature] = df_expanded[feature]
+    return X_new
+
+
+class PredictionCache:
+    """
+    LRU cache of model predictions keyed by feature tuple, for one set of models (model_key).
+    A cache saved for different models is ignored when loaded.
+    """
+
+    def __init__(self, path=None, model_key='', max_entries=1_000_000):
+        self.path = path
+        self.model_key = model_key
+        self.max_entries = max_entries
+        self.labels = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            if saved['model_key'] == model_key:
+                self.labels = saved['labels']
+                self.entries = saved['entries']
+
+    def predict(self, models, X_new):
+        """Predictions for every row of X_new, as {label: array}; only unseen unique rows go through the models"""
+        labels = list(models)
+        if self.labels != labels:
+            self.labels = labels
+            self.entries.clear()
+        unique_rows, inverse = np.unique(X_new.to_numpy(dtype=float), axis=0, return_inverse=True)
+        keys = [tuple(row) for row in unique_rows.tolist()]
+
+        unique_preds = np.empty((len(keys), len(labels)))
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.entries.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                self.entries.move_to_end(key)
+                unique_preds[i] = cached
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            X_missing = pd.DataFrame(unique_rows[missing], columns=X_new.columns).astype(X_new.dtypes.to_dict())
+            for j, label in enumerate(labels):
+                unique_preds[missing, j] = models[label].predict(X_missing)
+            for i in missing:
+                self.entries[keys[i]] = unique_preds[i].copy()
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        inverse = inverse.reshape(-1)
+        return {label: unique_preds[inverse, j] for j, label in enumerate(labels)}
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path, 'wb') as f:
+            pickle.dump({'model_key': self.model_key, 'labels': self.labels, 'entries': self.entries}, f)
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = 100 * self.hits / lookups if lookups else 0
+        print(f"Prediction cache: {self.hits:,} hits, {self.misses:,} misses ({rate:.1f}% hit rate), {len(self.entries):,} entries")
+
+
+def predict_chunk(df_expanded, models, features, cache=None):
+    """Log and original scale predictions for every pollutant, through the prediction cache when given"""
+    X_new = feature_matrix(df_expanded, features)
+    if cache is None:
+        cache = PredictionCache(max_entries=0)
+    for label, predictions in cache.predict(models, X_new).items():
+        df_expanded[f'Predicted_{label}'] = predictions
+    #Convert log predictions back to original scale
+    for label in models:
+        df_expanded[f'pred_{label}_emissions'] = np.exp(df_expanded[f'Predicted_{label}'])
+    return df_expanded
+
+
+def country_year_sums(df_expanded):
+    """Predicted totals and plant-year count per country and year of one chunk"""
+    sums = (
+        df_expanded[summary_cols].astype(float)  # float64 sums, the chunk columns are float32
+        .groupby([df_expanded['country'], df_expanded['year']], observed=True)
+        .sum()
+    )
+    sums['plant_years'] = df_expanded.groupby(['country', 'year'], observed=True).size()
+    return sums.reset_index()
+
+
+def add_to_summary(conn, sums, table=summary_table):
+    """Upsert country-year sums: new country-years are inserted, existing ones have the sums added"""
+    cols = ['country', 'year'] + summary_cols + ['plant_years']
+    updates = ', '.join(f'{col} = {col} + excluded.{col}' for col in summary_cols + ['plant_years'])
+    conn.exec_driver_sql(
+        f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)}) "
+        f"ON CONFLICT (country, year) DO UPDATE SET {updates}",
+        [tuple(row) for row in sums[cols].astype(object).values.tolist()]
+    )
+
+
+def refresh_country_year_summary(engine, countries=None, source='predicted_emissions', table=summary_table):
+    """Recompute the summary from the plant-year rows, for the given countries only (all of them if None)"""
+    where = ''
+    params = {}
+    if countries is not None:
+        params = {f'c{i}': country for i, country in enumerate(countries)}
+        where = f"WHERE country IN ({', '.join(':' + name for name in params)})" if params else 'WHERE 0'
+    sums = ', '.join(f'SUM({col})' for col in summary_cols)
+    with engine.begin() as conn:
+        if countries is None:
+            create_table(conn, table, replace=True)
+        else:
+            create_table(conn, table)
+            conn.execute(text(f"DELETE FROM {table} {where}"), params)
+        conn.execute(text(
+            f"INSERT INTO {table} (country, year, {', '.join(summary_cols)}, plant_years) "
+            f"SELECT country, year, {sums}, COUNT(*) FROM {source} {where} GROUP BY country, year"
+        ), params)
+    create_indexes(engine, [table])
+
+
+def ensure_country_year_summary(engine):
+    """Build the summary for a database written before it existed"""
+    if inspect(engine).has_table('predicted_emissions') and not inspect(engine).has_table(summary_table):
+        refresh_country_year_summary(engine)
+
+
+def stream_predictions(engine, models, features, years, table='predicted_emissions', chunk_rows=500_000, cache=None):
+    """
+    Expand, predict and append plant-years in chunks of about chunk_rows rows.
+    Plants get the compact dtypes before the expansion, so country and technology are repeated as category codes.
+    The old table is dropped first and the indexes are built after the last chunk. Returns the number of rows written.
+    Each chunk's country-year sums go into the summary table in the same transaction as its rows.
+    """
+    plants_per_chunk = max(1, chunk_rows // len(years))
+    summary = summary_table if table == 'predicted_emissions' else f'{table}_country_year'
+    with engine.begin() as conn:
+        create_table(conn, table, replace=True)
+        if summary in schemas:
+            create_table(conn, summary, replace=True)
+    if summary in schemas:
+        create_indexes(engine, [summary])  # the unique (country, year) key the upserts need
+    written = 0
+    largest = (0, 0)  # (default, compact) bytes of the biggest plant-year chunk
+    for plants in iter_plants(engine, plants_per_chunk):
+        df_expanded = expand_plant_years(prepare_plants(compact_dtypes(plants)), years)
+        if df_expanded.empty:
+            continue
+        df_expanded = compact_dtypes(predict_chunk(df_expanded, models, features, cache))
+        largest = max(largest, (default_memory(df_expanded), memory(df_expanded)))
+        with engine.begin() as conn:
+            written += bulk_insert(conn, table, df_expanded)
+            if summary in schemas:
+                add_to_summary(conn, country_year_sums(df_expanded), summary)
+    create_indexes(engine, [table])
+    print(f"Wrote {written:,} predicted plant-years to {table}")
+    print(f"Largest plant-year chunk memory: {largest[0] / 2**20:,.1f} MB with default dtypes -> {largest[1] / 2**20:,.1f} MB compact")
+    return written
@@ -0,0 +1,159 @@
+"""
+Report functions: Chinese plant emissions as a proportion of each recipient country's emissions
+
+The predicted side of the comparison comes from the predicted_emissions_country_year summary
+(one row per country and year) instead of the plant-year rows of predicted_emissions, so every country's
+actual emissions are counted once per year.
+All country x year x pollutant totals come from one groupby, and the charts are drawn with the
+Agg canvas directly (no pyplot, no window), so they can be rendered in batch on a server,
+on a process pool, to png/pdf files or to one multi-page pdf report.
+matplotlib is only imported when the first chart is drawn.
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from predict_functions import ensure_country_year_summary
+from startup_functions import lazy_import
+
+comparison_query = """
+SELECT 
+    nox_sulfur.entity, 
+    nox_sulfur.year, 
+    "nitrogen_oxide" as "nox_emissions", 
+    "sulfur_dioxide" as "so2_emissions",
+    "annual_co2" as "annual_co2_emissions",
+    summary.country,
+    summary.year as pred_year,
+    summary.pred_co2_emissions,
+    summary.pred_so2_emissions,
+    summary.pred_nox_emissions,
+    summary.plant_years
+FROM nox_sulfur
+JOIN carbon_accounting 
+    ON nox_sulfur.entity = carbon_accounting.entity 
+    AND nox_sulfur.year = carbon_accounting.year
+JOIN predicted_emissions_country_year AS summary
+    ON nox_sulfur.entity = summary.country 
+    AND nox_sulfur.year = summary.year
+"""
+
+chart_specs = {
+    'co2': {'actual': 'annual_co2_emissions', 'predicted': 'pred_co2_emissions', 'name': 'CO₂', 'units': 'million metric tons'},
+    'so2': {'actual': 'so2_emissions', 'predicted': 'pred_so2_emissions', 'name': 'SO2', 'units': 'thousand metric tons'},
+    'nox': {'actual': 'nox_emissions', 'predicted': 'pred_nox_emissions', 'name': 'NOx', 'units': 'thousand metric tons'},
+}
+
+
+def load_comparison(engine):
+    """Actual country emissions joined with the predicted Chinese plant emissions, in chart units"""
+    ensure_country_year_summary(engine)
+    nox_sulfur_carbon_df = pd.read_sql_query(comparison_query, con=engine)
+    # one row per country and year, so the actual emissions are the country's totals (the old plant-year join repeated
+    # them on every Chinese plant-year row, which inflated the Actual bars and % labels by the plant count)
+    nox_sulfur_carbon_df['pred_co2_emissions'] = nox_sulfur_carbon_df['pred_co2_emissions'] / 1e6  # convert to million metric tons
+    nox_sulfur_carbon_df['pred_so2_emissions'] = nox_sulfur_carbon_df['pred_so2_emissions'] / 1e3  # convert to thousand metric tons
+    nox_sulfur_carbon_df['pred_nox_emissions'] = nox_sulfur_carbon_df['pred_nox_emissions'] / 1e3 # convert to thousand metric tons
+    nox_sulfur_carbon_df['nox_emissions'] = nox_sulfur_carbon_df['nox_emissions'] / 1e3  # convert to thousand metric tons
+    nox_sulfur_carbon_df['so2_emissions'] = nox_sulfur_carbon_df['so2_emissions'] / 1e3 # convert to thousand metric tons
+    nox_sulfur_carbon_df['annual_co2_emissions'] = nox_sulfur_carbon_df['annual_co2_emissions'] / 1e6 # convert to million metric tons
+    # Make sure year columns are numeric
+    nox_sulfur_carbon_df['year'] = nox_sulfur_carbon_df['year'].astype(int)
+    nox_sulfur_carbon_df['pred_year'] = nox_sulfur_carbon_df['pred_year'].astype(int)
+    return nox_sulfur_carbon_df
+
+
+def country_year_aggregates(nox_sulfur_carbon_df):
+    """Actual and predicted totals for every country and year, all pollutants in one groupby"""
+    value_cols = [col for spec in chart_specs.values() for col in (spec['actual'], spec['predicted'])]
+    return (
+        nox_sulfur_carbon_df
+        .groupby(['country', 'year'])[value_cols]
+        .sum()
+        .reset_index()
+        .sort_values(['country', 'year'])
+    )
+
+
+def draw_country_chart(country, country_df, pollutant):
+    """Stacked bar chart of other vs Chinese plant emissions for one country, None if there is nothing to show"""
+    spec = chart_specs[pollutant]
+    years = country_df['year'].astype(int).tolist()
+    actual = country_df[spec['actual']].to_numpy()
+    # optionally ensure the stack never goes negative
+    predicted = country_df[spec['predicted']].clip(upper=country_df[spec['actual']]).to_numpy()
+
+    if predicted.sum() == 0 and actual.sum() == 0:
+        return None
+
+    other = actual - predicted
+
+    Figure = lazy_import('matplotlib.figure').Figure
+    fig = Figure(figsize=(10, 5))
+    ax = fig.add_subplot()
+    ax.bar(years, other, label=f"Other {spec['name']}", color='gray')
+    ax.bar(years, predicted, bottom=other, label=f"Chinese Plants {spec['name']}", color='red')
+
+    # % labels (light offset based on scale)
+    for x, tot, chi in zip(years, actual, predicted):
+        if tot > 0:
+            pct = 100 * chi / tot
+            if pct >= 1:
+                ax.text(x, tot * 1.01, f"{pct:.1f}%", ha='center', fontsize=8)
+
+    ax.set_title(f"{spec['name']} Emissions in {country} (Actual vs. Chinese Plants)")
+    ax.set_xlabel("Year")
+    ax.set_ylabel(f"{spec['name']} Emissions ({spec['units']})")
+    ax.set_xticks(years, [str(y) for y in years], rotation=45)
+    ax.grid(axis='y', linestyle='--', alpha=0.6)
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def chart_filename(country, pollutant, fmt):
+    safe_country = re.sub(r'\W+', '_', country).strip('_')
+    return f"{pollutant}_{safe_country}.{fmt}"
+
+
+def render_country(country, country_df, out_dir, fmt):
+    """Render all pollutant charts for one country to files, returns the paths written"""
+    paths = []
+    for pollutant in chart_specs:
+        fig = draw_country_chart(country, country_df, pollutant)
+        if fig is None:
+            continue
+        path = os.path.join(out_dir, chart_filename(country, pollutant, fmt))
+        fig.savefig(path)
+        paths.append(path)
+    return paths
+
+
+def render_reports(aggregates, out_dir, fmt='png', workers=1):
+    """Write one chart file per country and pollutant, countries spread over a process pool"""
+    os.makedirs(out_dir, exist_ok=True)
+    countries = list(aggregates.groupby('country'))
+    if workers is not None and workers > 1 and len(countries) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(render_country, country, country_df, out_dir, fmt) for country, country_df in countries]
+            paths = [path for future in futures for path in future.result()]
+    else:
+        paths = [path for country, country_df in countries for path in render_country(country, country_df, out_dir, fmt)]
+    print(f"Wrote {len(paths)} charts to {out_dir}")
+    return paths
+
+
+def render_pdf_report(aggregates, path):
+    """All charts in one multi-page pdf, pollutant by pollutant like the original plots"""
+    pages = 0
+    PdfPages = lazy_import('matplotlib.backends.backend_pdf').PdfPages
+    with PdfPages(path) as pdf:
+        for pollutant in chart_specs:
+            for country, country_df in aggregates.groupby('country'):
+                fig = draw_country_chart(country, country_df, pollutant)
+                if fig is not None:
+                    pdf.savefig(fig)
+                    pages += 1
+    print(f"Wrote {pages} pages to {path}")
+    return pages
@@ -0,0 +1,130 @@
+"""
+Scenario functions: sensitivity sweeps over the assumptions behind the plant predictions
+
+A scenario is a capacity factor (share of the 8760 hours a year the plant runs at full load),
+a year range and a fuel assignment (which fuel each technology is assumed to burn, e.g. every
+coal plant converted to gas). scenario_grid makes every combination of the given values.
+
+For each page of plants the plant-years of every scenario are built as one stacked feature
+matrix with array indexing (no per-scenario loop), and each model predicts it in one call,
+through the PredictionCache so feature rows shared between scenarios are predicted once.
+The results go to the scenario_emissions table: one row per scenario, country and year.
+"""
+
+import numpy as np
+import pandas as pd
+from predict_functions import iter_plants, prepare_plants, expand_plant_years, PredictionCache, summary_cols
+from storage_functions import replace_table
+from dtype_functions import compact_dtypes
+
+scenario_table = 'scenario_emissions'
+grid_cols = ['scenario_id', 'capacity_factor', 'start_year', 'end_year', 'fuel_assignment']
+
+
+def scenario_grid(capacity_factors=(1.0,), year_ranges=((1995, 2040),), fuel_assignments=None):
+    """
+    One row per combination of capacity factor, (start, end) year range (end not included)
+    and fuel assignment name. fuel_assignments: {name: {technology: fuel}}, '*' for every technology;
+    technologies missing from the mapping keep their own fuel. Default: fuels as reported.
+    """
+    fuel_assignments = fuel_assignments or {'as_reported': {}}
+    rows = [
+        (factor, start, end, name)
+        for factor in capacity_factors
+        for start, end in year_ranges
+        for name in fuel_assignments
+    ]
+    grid = pd.DataFrame(rows, columns=grid_cols[1:])
+    grid.insert(0, 'scenario_id', np.arange(len(grid), dtype=np.int32))
+    return grid
+
+
+def fuel_codes(technologies, grid, fuel_assignments):
+    """(fuels, codes) where codes[s, t] is the index in fuels of the fuel technology t burns in scenario s"""
+    fuel_assignments = fuel_assignments or {'as_reported': {}}
+    assigned = {
+        name: [mapping.get(tech, mapping.get('*', tech)) for tech in technologies]
+        for name, mapping in fuel_assignments.items()
+    }
+    fuels = sorted({fuel for row in assigned.values() for fuel in row})
+    lookup = {fuel: i for i, fuel in enumerate(fuels)}
+    codes = np.array([[lookup[fuel] for fuel in assigned[name]] for name in grid['fuel_assignment']], dtype=np.int32)
+    return fuels, codes.reshape(len(grid), len(technologies))
+
+
+def scenario_features(plants, grid, features, fuel_assignments=None):
+    """
+    Features of every scenario's plant-years for one page of prepared plants, as one stacked frame.
+    Plants are expanded once over the union of the year ranges; (scenario, plant-year) pairs inside each
+    scenario's range are picked with a boolean scenario x plant-year mask.
+    Returns (X, scenario_idx, plant_years) where row i of X is scenario scenario_idx[i] of plant_years row i.
+    """
+    years = np.arange(grid['start_year'].min(), grid['end_year'].max())
+    base = expand_plant_years(plants, years)
+    tech_codes, technologies = pd.factorize(base['technology'].astype(str).str.lower())
+    fuels, codes = fuel_codes(list(technologies), grid, fuel_assignments)
+
+    year = base['year'].to_numpy()
+    in_range = (year >= grid['start_year'].to_numpy()[:, None]) & (year < grid['end_year'].to_numpy()[:, None])
+    scenario_idx, row_idx = np.nonzero(in_range)
+    fuel = codes[scenario_idx, tech_codes[row_idx]]
+
+    X = {}
+    for feature in features:
+        if feature.startswith('fuel_group_'):
+            name = feature[len('fuel_group_'):]
+            X[feature] = (fuel == fuels.index(name)).astype(int) if name in fuels else np.zeros(len(fuel), dtype=int)
+        elif feature == 'generation_mwh':
+            X[feature] = base[feature].to_numpy()[row_idx] * grid['capacity_factor'].to_numpy()[scenario_idx]
+        else:
+            X[feature] = base[feature].to_numpy()[row_idx]
+    return pd.DataFrame(X), scenario_idx, base.iloc[row_idx].reset_index(drop=True)
+
+
+def scenario_chunk_sums(models, X, scenario_idx, plant_years, cache):
+    """Predict a stacked chunk (one call per model) and sum it by scenario, country and year"""
+    predictions = cache.predict(models, X)
+    sums = pd.DataFrame({
+        'scenario_id': scenario_idx.astype(np.int32),
+        'country': plant_years['country'].to_numpy(),
+        'year': plant_years['year'].to_numpy(),
+    })
+    for label in models:
+        sums[f'pred_{label}_emissions'] = np.exp(predictions[label])
+    grouped = sums.groupby(['scenario_id', 'country', 'year'], observed=True)
+    out = grouped[summary_cols].sum()
+    out['plant_years'] = grouped.size()
+    return out
+
+
+def run_scenarios(engine, models, features, grid, fuel_assignments=None, chunk_rows=2_000_000, cache=None, table=scenario_table):
+    """
+    Evaluate every scenario of the grid on the power_plant table, a page of plants at a time
+    (about chunk_rows stacked rows per page). Writes and returns the scenario table.
+    """
+    n_years = int(grid['end_year'].max() - grid['start_year'].min())
+    plants_per_chunk = max(1, chunk_rows // (n_years * len(grid)))
+    if cache is None:
+        cache = PredictionCache()
+    chunks = []
+    stacked = 0
+    for plants in iter_plants(engine, plants_per_chunk):
+        prepared = prepare_plants(compact_dtypes(plants))
+        if prepared.empty:
+            continue
+        X, scenario_idx, plant_years = scenario_features(prepared, grid, features, fuel_assignments)
+        if X.empty:
+            continue
+        stacked += len(X)
+        chunks.append(scenario_chunk_sums(models, X, scenario_idx, plant_years, cache))
+
+    if chunks:
+        # a country's plants can be spread over several pages
+        totals = pd.concat(chunks).groupby(level=['scenario_id', 'country', 'year'], observed=True).sum().reset_index()
+    else:
+        totals = pd.DataFrame(columns=['scenario_id', 'country', 'year'] + summary_cols + ['plant_years'])
+    totals['country'] = totals['country'].astype(str)
+    results = grid.merge(totals, on='scenario_id', how='inner')
+    replace_table(engine, table, results)
+    print(f"{len(grid)} scenarios, {stacked:,} scenario plant-years predicted, {len(results):,} rows written to {table}")
+    return results
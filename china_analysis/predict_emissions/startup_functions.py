@@ -0,0 +1,50 @@
+"""
+Startup functions: load heavy dependencies (sklearn, matplotlib, pyspark) on first use and time it
+
+Importing sklearn and matplotlib takes seconds and a SparkSession starts a JVM, so the pipeline modules
+only import them inside the functions that need them, through lazy_import / start. The time spent is
+recorded per dependency, so the pipeline can report startup separately from compute.
+"""
+
+import sys
+import time
+import importlib
+import importlib.util
+
+startup_seconds = {}  # dependency -> seconds spent importing or starting it
+started = {}  # name -> object made by start()
+
+
+def lazy_import(module):
+    """import module on first use (timed), later calls return the already imported module"""
+    if module in sys.modules:
+        return sys.modules[module]
+    begin = time.perf_counter()
+    loaded = importlib.import_module(module)
+    startup_seconds[module] = startup_seconds.get(module, 0) + time.perf_counter() - begin
+    return loaded
+
+
+def start(name, factory):
+    """Create an expensive object (e.g. a SparkSession) once, timed under name"""
+    if name not in started:
+        begin = time.perf_counter()
+        started[name] = factory()
+        startup_seconds[name] = startup_seconds.get(name, 0) + time.perf_counter() - begin
+    return started[name]
+
+
+def is_available(module):
+    """True when module can be imported, without importing it"""
+    return module in sys.modules or importlib.util.find_spec(module.split('.')[0]) is not None
+
+
+def total_startup():
+    return sum(startup_seconds.values())
+
+
+def report_startup():
+    if not startup_seconds:
+        return
+    parts = ', '.join(f"{name} {seconds:.2f} s" for name, seconds in startup_seconds.items())
+    print(f"Startup: {total_startup():.2f} s ({parts})")
@@ -0,0 +1,211 @@
+"""
+Storage functions for power_plant_data.db (SQLite)
+
+- create_sqlite_engine: engine with performance pragmas (WAL journal, synchronous=NORMAL, bigger page cache)
+- typed schemas and composite indexes for the tables the pipeline joins on
+- bulk_insert: batched executemany inside the caller's transaction instead of row by row to_sql
+- query_plan / print_query_plans: EXPLAIN QUERY PLAN output, to check the pipeline's queries use the indexes
+"""
+
+import pandas as pd
+from sqlalchemy import create_engine, event, inspect, text
+
+pragmas = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -200000,  # negative = KiB, so about 200 MB
+    'temp_store': 'MEMORY',
+}
+
+
+def emissions_schema(pollutant):
+    return [
+        ('Plant Code', 'INTEGER NOT NULL'),
+        ('Aggregated Fuel Group', 'TEXT'),
+        ('Year', 'INTEGER NOT NULL'),
+        ('Generation (kWh)', 'REAL'),
+        (f'{pollutant.lower()}_emissions', 'REAL'),
+    ]
+
+
+schemas = {
+    'co2_emissions': emissions_schema('CO2'),
+    'so2_emissions': emissions_schema('SO2'),
+    'nox_emissions': emissions_schema('NOx'),
+    'predicted_emissions': [
+        ('id', 'INTEGER NOT NULL'),
+        ('year_commission', 'INTEGER'),
+        ('technology', 'TEXT'),
+        ('country', 'TEXT'),
+        ('generation_mwh', 'REAL'),
+        ('year', 'INTEGER NOT NULL'),
+        ('Predicted_co2', 'REAL'),
+        ('Predicted_so2', 'REAL'),
+        ('Predicted_nox', 'REAL'),
+        ('pred_co2_emissions', 'REAL'),
+        ('pred_so2_emissions', 'REAL'),
+        ('pred_nox_emissions', 'REAL'),
+    ],
+    # one row per recipient country and year, kept up to date with predicted_emissions (see predict_functions.py)
+    'predicted_emissions_country_year': [
+        ('country', 'TEXT NOT NULL'),
+        ('year', 'INTEGER NOT NULL'),
+        ('pred_co2_emissions', 'REAL'),
+        ('pred_so2_emissions', 'REAL'),
+        ('pred_nox_emissions', 'REAL'),
+        ('plant_years', 'INTEGER NOT NULL'),
+    ],
+    # one row per scenario, country and year (see scenario_functions.py)
+    'scenario_emissions': [
+        ('scenario_id', 'INTEGER NOT NULL'),
+        ('capacity_factor', 'REAL'),
+        ('start_year', 'INTEGER'),
+        ('end_year', 'INTEGER'),
+        ('fuel_assignment', 'TEXT'),
+        ('country', 'TEXT NOT NULL'),
+        ('year', 'INTEGER NOT NULL'),
+        ('pred_co2_emissions', 'REAL'),
+        ('pred_so2_emissions', 'REAL'),
+        ('pred_nox_emissions', 'REAL'),
+        ('plant_years', 'INTEGER NOT NULL'),
+    ],
+    # input tables: the Chinese power plants and the Our World in Data country emissions (joined in the comparison query)
+    'power_plant': [
+        ('Plant Name', 'TEXT'),
+        ('Country', 'TEXT'),
+        ('Technology', 'TEXT'),
+        ('Capacity (MW)', 'REAL'),
+        ('Year of Commission', 'INTEGER'),
+        ('id', 'INTEGER NOT NULL'),
+    ],
+    'carbon_accounting': [
+        ('entity', 'TEXT NOT NULL'),
+        ('code', 'TEXT'),
+        ('year', 'INTEGER NOT NULL'),
+        ('annual_co2', 'REAL'),
+    ],
+    'nox_sulfur': [
+        ('entity', 'TEXT NOT NULL'),
+        ('code', 'TEXT'),
+        ('year', 'INTEGER NOT NULL'),
+        ('nitrogen_oxide', 'REAL'),
+        ('sulfur_dioxide', 'REAL'),
+    ],
+    # AidData energy projects with the capacity read from their title/description (see capacity_functions.py)
+    'project_capacity': [
+        ('aid_data_record_id', 'INTEGER NOT NULL'),
+        ('aid_data_parent_id', 'INTEGER'),
+        ('title', 'TEXT'),
+        ('completion_year', 'INTEGER'),
+        ('country', 'TEXT'),
+        ('technology', 'TEXT'),
+        ('capacity_mw', 'REAL'),
+        ('capacity_low_mw', 'REAL'),
+        ('capacity_high_mw', 'REAL'),
+        ('capacity_text', 'TEXT'),
+        ('capacity_source', 'TEXT'),
+    ],
+}
+
+# index name -> (table, columns, unique)
+indexes = {
+    'ix_co2_emissions_plant_year': ('co2_emissions', ['Plant Code', 'Year', 'Aggregated Fuel Group'], True),
+    'ix_so2_emissions_plant_year': ('so2_emissions', ['Plant Code', 'Year', 'Aggregated Fuel Group'], True),
+    'ix_nox_emissions_plant_year': ('nox_emissions', ['Plant Code', 'Year', 'Aggregated Fuel Group'], True),
+    'ix_co2_emissions_year': ('co2_emissions', ['Year'], False),
+    'ix_so2_emissions_year': ('so2_emissions', ['Year'], False),
+    'ix_nox_emissions_year': ('nox_emissions', ['Year'], False),
+    'ix_power_plant_id': ('power_plant', ['id'], True),
+    'ix_nox_sulfur_entity_year': ('nox_sulfur', ['entity', 'year'], False),
+    'ix_carbon_accounting_entity_year': ('carbon_accounting', ['entity', 'year'], False),
+    'ix_predicted_emissions_country_year': ('predicted_emissions', ['country', 'year'], False),
+    'ix_predicted_emissions_country_year_key': ('predicted_emissions_country_year', ['country', 'year'], True),
+    'ix_scenario_emissions_key': ('scenario_emissions', ['scenario_id', 'country', 'year'], True),
+    'ix_project_capacity_record': ('project_capacity', ['aid_data_record_id'], True),
+}
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def create_sqlite_engine(path):
+    """SQLAlchemy engine for a SQLite file, with the pragmas set on every new connection"""
+    engine = create_engine(f'sqlite:///{path}')
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+
+def create_table(conn, table, replace=False):
+    """CREATE TABLE from the typed schema"""
+    if replace:
+        conn.execute(text(f"DROP TABLE IF EXISTS {quote(table)}"))
+    columns = ', '.join(f"{quote(col)} {col_type}" for col, col_type in schemas[table])
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {quote(table)} ({columns})"))
+
+
+def create_indexes(engine, tables=None):
+    """Create the indexes for every table that exists (or only the given tables)"""
+    existing = set(inspect(engine).get_table_names())
+    with engine.begin() as conn:
+        for name, (table, columns, unique) in indexes.items():
+            if table not in existing or (tables is not None and table not in tables):
+                continue
+            col_list = ', '.join(quote(col) for col in columns)
+            conn.execute(text(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {quote(table)} ({col_list})"))
+
+
+def bulk_insert(conn, table, df, batch_size=50_000):
+    """
+    Insert a dataframe with batched executemany on an open connection (run it inside engine.begin()
+    so every batch is one transaction). Tables with a typed schema are created first.
+    """
+    if table in schemas:
+        create_table(conn, table)
+    elif not inspect(conn).has_table(table):
+        df.head(0).to_sql(table, con=conn, index=False)
+    if df.empty:
+        return 0
+
+    columns = ', '.join(quote(col) for col in df.columns)
+    placeholders = ', '.join('?' for _ in df.columns)
+    insert_sql = f"INSERT INTO {quote(table)} ({columns}) VALUES ({placeholders})"
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size]
+        # python objects (not numpy scalars) and None for missing values, which sqlite3 understands
+        rows = batch.astype(object).where(batch.notna(), None).values.tolist()
+        conn.exec_driver_sql(insert_sql, [tuple(row) for row in rows])
+    return len(df)
+
+
+def replace_table(engine, table, df):
+    """Drop, create from the typed schema, bulk load and index a table in one transaction"""
+    with engine.begin() as conn:
+        create_table(conn, table, replace=True)
+        bulk_insert(conn, table, df)
+    create_indexes(engine, [table])
+
+
+def query_plan(engine, query, params=None):
+    """EXPLAIN QUERY PLAN rows for a query"""
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {query}"), params or {}).fetchall()
+    return pd.DataFrame(rows, columns=['id', 'parent', 'notused', 'detail'])
+
+
+def print_query_plans(engine, queries):
+    """Print the plan of every {name: query or (query, params)}; SCAN lines without an index are full table scans"""
+    for name, query in queries.items():
+        params = None
+        if isinstance(query, tuple):
+            query, params = query
+        print(f"--- {name} ---")
+        for detail in query_plan(engine, query, params)['detail']:
+            print(f"  {detail}")
@@ -0,0 +1,155 @@
+"""
+Synthetic data for benchmarking the emissions pipeline without the private Chinese power plant workbook
+
+- make_eia_workbooks: emissions{year}.xlsx files shaped like the eia.gov ones (title row, CO2/SO2/NOx sheets,
+  several prime mover rows per plant and fuel group, a footnote row at the bottom)
+- make_power_plants: a Chinese power plant table with the columns power_analysis.py reads
+- make_country_tables: carbon_accounting (co2_all_country) and nox_sulfur (nitrogen_sulfur_all_country) tables
+
+Usage: python synthetic_data.py out_dir --eia-plants 5000 --plants 20000 --years 2013-2023
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+fuel_groups = {
+    # fuel group: (share of plant fuel groups, tonnes CO2 per MWh, kg SO2 per MWh, kg NOx per MWh)
+    'COAL': (0.30, 1.00, 1.20, 0.80),
+    'GAS': (0.45, 0.45, 0.005, 0.25),
+    'PET': (0.20, 0.80, 0.90, 1.50),
+    'MSW': (0.03, 0.60, 0.20, 0.90),
+    'GEO': (0.02, 0.05, 0.10, 0.01),
+}
+prime_movers = ['ST', 'CT', 'CA', 'GT', 'IC']
+technologies = ['coal', 'gas', 'oil', 'Coal', 'hydropower', 'solar', 'wind', 'nuclear']
+technology_weights = [0.35, 0.15, 0.05, 0.05, 0.15, 0.1, 0.1, 0.05]
+footnote = "Notes:\nThe emissions data presented include total emissions from electric power plants (synthetic)."
+sheet_titles = {
+    'CO2': 'Carbon Dioxide Emissions at Electric Power Plants',
+    'SO2': 'Sulfur Dioxide Emissions at Electric Power Plants',
+    'NOx': 'Nitrogen Oxides Emissions at Electric Power Plants',
+}
+
+
+def plant_fuel_rows(n_plants, rng):
+    """Every plant gets 1-3 fuel groups and every fuel group 1-3 prime mover rows"""
+    names = list(fuel_groups)
+    shares = np.array([fuel_groups[name][0] for name in names])
+    rows = []
+    for plant in range(1, n_plants + 1):
+        for fuel in rng.choice(names, size=rng.integers(1, 4), replace=False, p=shares):
+            for mover in rng.choice(prime_movers, size=rng.integers(1, 4), replace=False):
+                rows.append((plant, fuel, mover))
+    plants = pd.DataFrame(rows, columns=['Plant Code', 'Aggregated Fuel Group', 'Prime Mover'])
+    plants['base_generation_mwh'] = rng.lognormal(mean=11, sigma=2, size=len(plants))
+    return plants
+
+
+def eia_year_sheets(plants, year, rng):
+    """CO2, SO2 and NOx sheets for one year; plants drift a little year to year and CO2 skips some rows like the real files"""
+    df = plants.copy()
+    df['Plant Name'] = 'Plant ' + df['Plant Code'].astype(str)
+    df['State'] = rng.choice(['AL', 'AK', 'TX', 'CA', 'NY', 'PA'], size=len(df))
+    df['Fuel Code'] = df['Aggregated Fuel Group'].map({'COAL': 'BIT', 'GAS': 'NG', 'PET': 'DFO', 'MSW': 'MSB', 'GEO': 'GEO'})
+    generation_mwh = df['base_generation_mwh'] * rng.lognormal(0, 0.2, size=len(df)) * (1 + 0.01 * (year - 2013))
+    df['Generation (kWh)'] = (generation_mwh * 1000).round()
+    factors = df['Aggregated Fuel Group'].map(lambda fuel: fuel_groups[fuel][1:])
+    noise = rng.lognormal(0, 0.3, size=(len(df), 3))
+    co2 = generation_mwh * np.array([f[0] for f in factors]) * noise[:, 0]
+    so2 = generation_mwh * np.array([f[1] for f in factors]) / 1000 * noise[:, 1]
+    nox = generation_mwh * np.array([f[2] for f in factors]) / 1000 * noise[:, 2]
+
+    base_cols = ['Plant Code', 'Plant Name', 'State', 'Prime Mover', 'Fuel Code', 'Aggregated Fuel Group', 'Generation (kWh)']
+    sheets = {
+        'CO2': df[base_cols].assign(**{'Tons of CO2 Emissions': co2 * 1.10231, 'Metric Tonnes of CO2 Emissions': co2}),
+        'SO2': df[base_cols].assign(**{'Selected SO2 Emissions (Tons)': so2 * 1.10231, 'Selected SO2 Emissions (Metric Tonnes)': so2}),
+        'NOx': df[base_cols].assign(**{'Selected NOx Emissions (Tons)': nox * 1.10231, 'Selected NOx Emissions (Metric Tonnes)': nox}),
+    }
+    sheets['CO2'] = sheets['CO2'][rng.random(len(df)) > 0.1]
+    return sheets
+
+
+def write_eia_workbook(path, year, sheets):
+    """Title row, header row, data, then a footnote row in the Plant Code column"""
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for sheet, df in sheets.items():
+            df = pd.concat([df, pd.DataFrame({'Plant Code': [footnote]})], ignore_index=True)
+            df.to_excel(writer, sheet_name=sheet, startrow=1, index=False)
+            writer.sheets[sheet].cell(row=1, column=1, value=f"{year} {sheet_titles[sheet]}")
+
+
+def make_eia_workbooks(out_dir, years, n_plants=5000, seed=42):
+    """Write emissions{year}.xlsx for every year, returns the file names"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    plants = plant_fuel_rows(n_plants, rng)
+    files = []
+    for year in years:
+        filename = f'emissions{year}.xlsx'
+        write_eia_workbook(os.path.join(out_dir, filename), year, eia_year_sheets(plants, year, rng))
+        files.append(filename)
+    return files
+
+
+def make_power_plants(n_plants, countries, seed=42):
+    """Chinese power plant table: capacity, commission year, technology and recipient country"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Plant Name': [f'Synthetic plant {i}' for i in range(1, n_plants + 1)],
+        'Country': rng.choice(countries, size=n_plants),
+        'Technology': rng.choice(technologies, size=n_plants, p=technology_weights),
+        'Capacity (MW)': rng.choice([50, 100, 150, 300, 600, 660, 1000, 1320], size=n_plants).astype(float),
+        'Year of Commission': rng.integers(1990, 2033, size=n_plants),
+    })
+
+
+def make_country_tables(countries, years=range(1990, 2040), seed=42):
+    """(carbon_accounting, nox_sulfur) tables in the Our World in Data layout"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for country in countries:
+        scale = rng.lognormal(17, 1.5)
+        for year in years:
+            growth = 1.02 ** (year - years[0])
+            rows.append((country, country[:3].upper(), year, scale * growth,
+                         scale * growth * 2e-3 * rng.lognormal(0, 0.1), scale * growth * 3e-3 * rng.lognormal(0, 0.1)))
+    df = pd.DataFrame(rows, columns=['entity', 'code', 'year', 'annual_co2', 'nitrogen_oxide', 'sulfur_dioxide'])
+    return df[['entity', 'code', 'year', 'annual_co2']], df[['entity', 'code', 'year', 'nitrogen_oxide', 'sulfur_dioxide']]
+
+
+def country_names(n_countries):
+    return [f'Country {i:03d}' for i in range(1, n_countries + 1)]
+
+
+def parse_years(years):
+    """'2013-2023' or '2013,2015' -> list of years"""
+    if '-' in years:
+        start, end = years.split('-')
+        return list(range(int(start), int(end) + 1))
+    return [int(year) for year in years.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic EIA, power plant and country data")
+    parser.add_argument('out_dir')
+    parser.add_argument('--eia-plants', type=int, default=5000, help="plants in every EIA workbook")
+    parser.add_argument('--plants', type=int, default=20000, help="Chinese power plants")
+    parser.add_argument('--countries', type=int, default=40)
+    parser.add_argument('--years', default='2013-2023', help="EIA workbook years, e.g. 2013-2023")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    countries = country_names(args.countries)
+    eia_dir = os.path.join(args.out_dir, 'eia')
+    files = make_eia_workbooks(eia_dir, parse_years(args.years), args.eia_plants, args.seed)
+    make_power_plants(args.plants, countries, args.seed).to_excel(os.path.join(args.out_dir, 'chinese_power_plant.xlsx'), index=False)
+    carbon, nox_sulfur = make_country_tables(countries, seed=args.seed)
+    carbon.to_excel(os.path.join(args.out_dir, 'co2_all_country.xlsx'), index=False)
+    nox_sulfur.to_excel(os.path.join(args.out_dir, 'nitrogen_sulfur_all_country.xlsx'), index=False)
+    print(f"Wrote {len(files)} EIA workbooks to {eia_dir} and the plant/country tables to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
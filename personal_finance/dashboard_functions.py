@@ -3,12 +3,14 @@ Dashboard utility functions for stock portfolio analysis
 """
 
 import pandas as pd
-import yfinance as yf
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import pytz
 from sqlalchemy import text
+from price_history_functions import get_history, ticker_history, market_today
+from price_provider_functions import provider
+from price_write_functions import bulk_update_prices
 
 def update_stock_prices(engine):
     """Update current prices for all stocks in the database"""
@@ -20,18 +22,16 @@ def update_stock_prices(engine):
         if not ticker:
             return False, "No tickers found in database"
         
-        data = yf.download(ticker, period="1d", progress=False)
-        current_prices = data['Close'].iloc[-1]
+        current_prices, errors = provider.latest_quotes(ticker)
+        if not current_prices:
+            return False, f"Error updating prices: no prices fetched ({len(errors)} tickers failed)"
         
-        with engine.connect() as conn:
-            for ticker_symbol, price in current_prices.items():
-                conn.execute(
-                    text("UPDATE stocks SET current_price = :price WHERE ticker = :ticker"),
-                    {"price": float(price), "ticker": ticker_symbol}
-                )
-            conn.commit()
+        rows, seconds = bulk_update_prices(engine, current_prices)
         
-        return True, f"Successfully updated prices for {len(current_prices)} stocks"
+        message = f"Successfully updated prices for {rows} stocks in {seconds:.2f}s"
+        if errors:
+            message += f" ({len(errors)} failed: {', '.join(errors)})"
+        return True, message
         
     except Exception as e:
         return False, f"Error updating prices: {e}"
@@ -87,16 +87,16 @@ def get_daily_performance(engine):
             return None
         
         tickers = current_df['ticker'].unique().tolist()
-        data = yf.download(tickers, period="2d", progress=False)
+        # the last week of daily bars: older days come from the price_history store, only today is downloaded
+        today = market_today()
+        bars = get_history(engine, tickers, today - timedelta(days=7), today + timedelta(days=1))
+        closes = bars.pivot(index='ts', columns='ticker', values='Close')
         
         daily_changes = []
         
         for ticker in tickers:
             try:
-                if len(tickers) == 1:
-                    prices = data['Close']
-                else:
-                    prices = data['Close'][ticker]
+                prices = closes[ticker].dropna()
                 
                 if len(prices) >= 2:
                     today_price = prices.iloc[-1]
@@ -129,12 +129,15 @@ def get_daily_performance(engine):
         print(f"Error getting daily performance: {e}")
         return None
 
-def get_intraday_data(ticker_symbol):
-    """Get intraday data for a specific stock"""
+def get_intraday_data(ticker_symbol, engine):
+    """Get intraday data for a specific stock (the last trading day's 1 minute bars)"""
     try:
-        stock = yf.Ticker(ticker_symbol)
-        hist = stock.history(period="1d", interval="1m")
-        return hist
+        # earlier sessions come from the price_history store, today's bars are downloaded again
+        today = market_today()
+        hist = ticker_history(engine, ticker_symbol, today - timedelta(days=6), today + timedelta(days=1), interval="1m")
+        if hist.empty:
+            return hist
+        return hist[hist.index.normalize() == hist.index.normalize().max()]
     except Exception as e:
         print(f"Error getting intraday data for {ticker_symbol}: {e}")
         return None
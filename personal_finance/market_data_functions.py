@@ -0,0 +1,93 @@
+"""
+Market data functions: concurrent yfinance requests with rate limiting and retries
+
+MarketDataClient runs one request per ticker on a bounded thread pool, so a refresh takes about
+(tickers / max_workers) request times instead of one request time per ticker. Every request first
+takes a token from a shared token bucket (rate requests per second, bursts up to burst) so the pool
+can't flood Yahoo, and failed requests are retried with exponential backoff and jitter.
+A ticker that still fails doesn't fail the call: results come back as (data, errors) dicts by ticker.
+"""
+
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import yfinance as yf
+
+# errors that mean "no data for this ticker/range" (weekend, holiday, delisted): retrying won't help
+no_data_errors = tuple(
+    getattr(yf.exceptions, name)
+    for name in ('YFPricesMissingError', 'YFTzMissingError')
+    if hasattr(getattr(yf, 'exceptions', None), name)
+)
+
+
+class TokenBucket:
+    """Thread-safe rate limiter: rate tokens a second on average, at most capacity at once"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class MarketDataClient:
+    """Per-ticker yfinance requests on a thread pool, behind a token bucket, with retries"""
+
+    def __init__(self, max_workers=8, rate=5, burst=10, retries=3, backoff=0.5):
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+
+    def call(self, request, ticker):
+        """request(ticker) with up to retries retries, waiting backoff * 2^attempt (plus jitter) in between"""
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            try:
+                return request(ticker)
+            except no_data_errors:
+                return pd.DataFrame()
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    def fetch(self, tickers, request):
+        """Run request(ticker) for every ticker concurrently. Returns ({ticker: result}, {ticker: error message})"""
+        tickers = list(dict.fromkeys(tickers))
+        results, errors = {}, {}
+        if not tickers:
+            return results, errors
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tickers))) as pool:
+            futures = {ticker: pool.submit(self.call, request, ticker) for ticker in tickers}
+            for ticker, future in futures.items():
+                try:
+                    results[ticker] = future.result()
+                except Exception as e:
+                    errors[ticker] = str(e)
+        return results, errors
+
+    def history(self, tickers, **kwargs):
+        """yf.Ticker(ticker).history(**kwargs) for every ticker. Returns ({ticker: bars}, {ticker: error})"""
+        kwargs.setdefault('auto_adjust', True)
+        return self.fetch(tickers, lambda ticker: yf.Ticker(ticker).history(raise_errors=True, **kwargs))
+
+
+client = MarketDataClient()
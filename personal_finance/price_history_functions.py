@@ -0,0 +1,228 @@
+"""
+Price history functions: a local OHLCV store so prices we already downloaded are not fetched again
+
+Bars live in the price_history table (one row per ticker, interval and bar time). price_history_coverage
+keeps, per ticker and interval, the [start_date, end_date) ranges that have been downloaded, including
+weekends and holidays that have no bars, so only the missing ranges are fetched from yfinance.
+Tickers missing the same range are downloaded together, from the configured price provider (price_provider_functions.py).
+Bars from a provider without persist (replayed or synthetic bars) are never stored: they are fetched on every call.
+Today's bars still change until the close, so today is never marked as covered and is always refreshed.
+"""
+
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytz
+from sqlalchemy import text, bindparam
+from price_provider_functions import provider
+
+bar_columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+tables_ready = set()  # engine urls the tables were created on
+
+
+def market_today():
+    """Today's date on the exchange (US/Eastern)"""
+    return datetime.now(pytz.timezone('US/Eastern')).date()
+
+
+def create_price_history_tables(engine):
+    """Create price_history and price_history_coverage if they don't exist (once per engine)"""
+    if str(engine.url) in tables_ready:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS price_history (
+                ticker VARCHAR(20) NOT NULL,
+                bar_interval VARCHAR(5) NOT NULL,
+                ts DATETIME NOT NULL,
+                open DOUBLE,
+                high DOUBLE,
+                low DOUBLE,
+                close DOUBLE,
+                volume BIGINT,
+                PRIMARY KEY (ticker, bar_interval, ts)
+            )
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS price_history_coverage (
+                ticker VARCHAR(20) NOT NULL,
+                bar_interval VARCHAR(5) NOT NULL,
+                start_date DATE NOT NULL,
+                end_date DATE NOT NULL,
+                PRIMARY KEY (ticker, bar_interval, start_date)
+            )
+        """))
+    tables_ready.add(str(engine.url))
+
+
+def missing_ranges(covered, start, end):
+    """Parts of [start, end) not inside any of the covered (start, end) ranges"""
+    gaps = []
+    cursor = start
+    for range_start, range_end in sorted(covered):
+        if range_end <= cursor:
+            continue
+        if range_start >= end:
+            break
+        if range_start > cursor:
+            gaps.append((cursor, range_start))
+        cursor = max(cursor, range_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def merge_ranges(ranges):
+    """Overlapping or touching (start, end) ranges joined into one"""
+    merged = []
+    for range_start, range_end in sorted(ranges):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+        else:
+            merged.append((range_start, range_end))
+    return merged
+
+
+def read_coverage(conn, tickers, interval):
+    """{ticker: [(start_date, end_date), ...]} already downloaded"""
+    query = text("""
+        SELECT ticker, start_date, end_date FROM price_history_coverage
+        WHERE bar_interval = :interval AND ticker IN :tickers
+    """).bindparams(bindparam('tickers', expanding=True))
+    coverage = {}
+    for ticker, start_date, end_date in conn.execute(query, {"interval": interval, "tickers": tickers}):
+        coverage.setdefault(ticker, []).append((pd.Timestamp(start_date).date(), pd.Timestamp(end_date).date()))
+    return coverage
+
+
+def download_bars(tickers, start, end, interval='1d'):
+    """
+    Bars of tickers over [start, end) from the price provider, as long rows: ticker, ts, Open, High, Low,
+    Close, Volume. Tickers that failed are left out (and reported), so their range isn't marked as covered.
+    """
+    if interval == '1d':
+        data, errors = provider.daily_bars(tickers, start, end)
+    else:
+        data, errors = provider.intraday_bars(tickers, start, end, interval)
+    for ticker, error in errors.items():
+        print(f"Error downloading {interval} bars for {ticker} from {start} to {end}: {error}")
+
+    frames = []
+    for ticker, hist in data.items():
+        if hist.empty:
+            continue
+        bars = hist[bar_columns].dropna(how='all')
+        if bars.empty:
+            continue
+        ts = bars.index.tz_localize(None) if bars.index.tz is not None else bars.index
+        frames.append(bars.reset_index(drop=True).assign(ticker=ticker, ts=ts))
+    if not frames:
+        return pd.DataFrame(columns=['ticker', 'ts'] + bar_columns)
+    return pd.concat(frames, ignore_index=True)[['ticker', 'ts'] + bar_columns]
+
+
+def store_bars(conn, bars, interval):
+    """Insert or refresh bars in price_history"""
+    if bars.empty:
+        return
+    value = lambda x, kind=float: None if pd.isna(x) else kind(x)
+    rows = [
+        {"ticker": row.ticker, "interval": interval, "ts": pd.Timestamp(row.ts).to_pydatetime(),
+         "open": value(row.Open), "high": value(row.High), "low": value(row.Low), "close": value(row.Close),
+         "volume": value(row.Volume, int)}
+        for row in bars.itertuples(index=False)
+    ]
+    conn.execute(text("""
+        INSERT INTO price_history (ticker, bar_interval, ts, open, high, low, close, volume)
+        VALUES (:ticker, :interval, :ts, :open, :high, :low, :close, :volume)
+        ON DUPLICATE KEY UPDATE open = VALUES(open), high = VALUES(high), low = VALUES(low),
+            close = VALUES(close), volume = VALUES(volume)
+    """), rows)
+
+
+def record_coverage(conn, fetched, coverage, interval):
+    """Add the fetched ranges to every ticker's coverage, stored merged"""
+    tickers = list(fetched)
+    conn.execute(text("""
+        DELETE FROM price_history_coverage WHERE bar_interval = :interval AND ticker IN :tickers
+    """).bindparams(bindparam('tickers', expanding=True)), {"interval": interval, "tickers": tickers})
+    rows = [
+        {"ticker": ticker, "interval": interval, "start_date": range_start, "end_date": range_end}
+        for ticker in tickers
+        for range_start, range_end in merge_ranges(coverage.get(ticker, []) + fetched[ticker])
+    ]
+    conn.execute(text("""
+        INSERT INTO price_history_coverage (ticker, bar_interval, start_date, end_date)
+        VALUES (:ticker, :interval, :start_date, :end_date)
+    """), rows)
+
+
+def read_bars(engine, tickers, start, end, interval):
+    query = text("""
+        SELECT ticker, ts, open AS Open, high AS High, low AS Low, close AS Close, volume AS Volume
+        FROM price_history
+        WHERE bar_interval = :interval AND ticker IN :tickers AND ts >= :start AND ts < :end
+        ORDER BY ticker, ts
+    """).bindparams(bindparam('tickers', expanding=True))
+    params = {"interval": interval, "tickers": tickers, "start": start, "end": end}
+    bars = pd.read_sql(query, engine, params=params)
+    bars['ts'] = pd.to_datetime(bars['ts'])
+    return bars
+
+
+def get_history(engine, tickers, start, end, interval='1d'):
+    """
+    OHLCV bars of tickers over [start, end) from the local store, downloading only the date ranges
+    that are not stored yet. Returns long rows: ticker, ts, Open, High, Low, Close, Volume.
+    """
+    tickers = list(dict.fromkeys([tickers] if isinstance(tickers, str) else tickers))
+    start, end = pd.Timestamp(start).date(), pd.Timestamp(end).date()
+    if not provider.persist:
+        return download_bars(tickers, start, end, interval).sort_values(['ticker', 'ts'], ignore_index=True)
+    create_price_history_tables(engine)
+    with engine.connect() as conn:
+        coverage = read_coverage(conn, tickers, interval)
+
+    # tickers missing the same range are downloaded together
+    by_range = {}
+    for ticker in tickers:
+        for gap in missing_ranges(coverage.get(ticker, []), start, end):
+            by_range.setdefault(gap, []).append(ticker)
+
+    today = market_today()
+    fetched = {}
+    for (gap_start, gap_end), group in by_range.items():
+        try:
+            bars = download_bars(group, gap_start, gap_end, interval)
+        except Exception as e:
+            print(f"Error downloading {interval} bars for {group} from {gap_start} to {gap_end}: {e}")
+            continue
+        with engine.begin() as conn:
+            store_bars(conn, bars, interval)
+        # today is still trading; a ticker without bars on a weekday may be a failed download, so it isn't marked either
+        complete_end = min(gap_end, today)
+        if gap_start >= complete_end:
+            continue
+        has_weekday = np.busday_count(gap_start, complete_end) > 0
+        returned = set(bars['ticker'])
+        for ticker in group:
+            if ticker in returned or not has_weekday:
+                fetched.setdefault(ticker, []).append((gap_start, complete_end))
+    if fetched:
+        with engine.begin() as conn:
+            record_coverage(conn, fetched, coverage, interval)
+
+    return read_bars(engine, tickers, start, end, interval)
+
+
+def ticker_history(engine, ticker, start, end, interval='1d'):
+    """One ticker's bars indexed by time, like yf.Ticker(ticker).history(start=start, end=end)"""
+    bars = get_history(engine, [ticker], start, end, interval)
+    return bars.set_index('ts')[bar_columns]
+
+
+def latest_closes(engine, tickers, days=7):
+    """{ticker: last close} from the bars of the last few days"""
+    today = market_today()
+    bars = get_history(engine, tickers, today - timedelta(days=days), today + timedelta(days=1))
+    return bars.groupby('ticker')['Close'].last().to_dict()
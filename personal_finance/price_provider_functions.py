@@ -0,0 +1,229 @@
+"""
+Price provider functions: where prices come from, behind one interface
+
+Every provider answers three requests for a list of tickers, each returning ({ticker: result}, {ticker: error}):
+- latest_quotes(tickers): last price
+- daily_bars(tickers, start, end): daily OHLCV bars over [start, end), indexed by time
+- intraday_bars(tickers, start, end, interval='1m'): intraday OHLCV bars
+Providers:
+- YFinanceProvider: Yahoo through the concurrent MarketDataClient (the default)
+- RecordingProvider: wraps another provider and saves every bar it returns under a directory
+- ReplayProvider: serves recorded bars (<directory>/<interval>/<TICKER>.csv), or synthetic ones for tickers that
+  weren't recorded, after a configurable latency per request, so the dashboard and scripts run without the network
+Only providers of real market data (persist = True) have their bars saved to the price_history store; replayed
+bars are served straight from the provider on every request, so they never mix with the real history.
+
+The provider is picked from environment variables, e.g. to benchmark the dashboard offline:
+    PRICE_PROVIDER=replay PRICE_REPLAY_LATENCY=0.05 PRICE_REPLAY_SYNTHETIC=1 streamlit run investment_dashboard.py
+Record real bars with: python price_provider_functions.py AAPL MSFT --days 365
+"""
+
+import os
+import time
+from abc import ABC, abstractmethod
+import zlib
+import argparse
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from market_data_functions import MarketDataClient, client
+
+bar_columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class PriceProvider(ABC):
+    """Latest quotes, daily bars and intraday bars; subclasses implement bars (and may override latest_quotes)"""
+
+    persist = False  # whether the bars are real market data that may be saved to price_history
+
+    @abstractmethod
+    def bars(self, tickers, start, end, interval):
+        """OHLCV bars of tickers over [start, end) at interval. Returns ({ticker: bars}, {ticker: error})"""
+
+    def daily_bars(self, tickers, start, end):
+        return self.bars(tickers, start, end, '1d')
+
+    def intraday_bars(self, tickers, start, end, interval='1m'):
+        return self.bars(tickers, start, end, interval)
+
+    def latest_quotes(self, tickers):
+        """Last close of the last 5 days' daily bars (weekends and holidays still have one)"""
+        today = pd.Timestamp.now(tz='US/Eastern').normalize().tz_localize(None)
+        bars, errors = self.daily_bars(tickers, today - timedelta(days=5), today + timedelta(days=1))
+        quotes = {}
+        for ticker, hist in bars.items():
+            closes = hist['Close'].dropna() if 'Close' in hist else pd.Series(dtype=float)
+            if closes.empty:
+                errors[ticker] = "No price data"
+            else:
+                quotes[ticker] = float(closes.iloc[-1])
+        return quotes, errors
+
+
+class YFinanceProvider(PriceProvider):
+    """Yahoo Finance, one request per ticker on the market data client's thread pool"""
+
+    persist = True
+
+    def __init__(self, market_client=None):
+        self.client = market_client or client
+
+    def bars(self, tickers, start, end, interval):
+        return self.client.history(tickers, start=start, end=end, interval=interval)
+
+
+def bar_path(directory, ticker, interval):
+    return os.path.join(directory, interval, f"{ticker}.csv")
+
+
+def read_bar_file(path):
+    bars = pd.read_csv(path, index_col='ts', parse_dates=['ts'])
+    return bars[bar_columns]
+
+
+def in_range(bars, start, end):
+    """Bars with start <= time < end (times compared without time zone)"""
+    index = bars.index.tz_localize(None) if bars.index.tz is not None else bars.index
+    return bars[(index >= pd.Timestamp(start)) & (index < pd.Timestamp(end))]
+
+
+class RecordingProvider(PriceProvider):
+    """Passes requests to provider and adds every bar it returns to the files a ReplayProvider reads"""
+
+    def __init__(self, provider, directory):
+        self.provider = provider
+        self.directory = directory
+        self.persist = provider.persist
+
+    def bars(self, tickers, start, end, interval):
+        data, errors = self.provider.bars(tickers, start, end, interval)
+        for ticker, hist in data.items():
+            if not hist.empty:
+                self.record(ticker, interval, hist)
+        return data, errors
+
+    def latest_quotes(self, tickers):
+        return self.provider.latest_quotes(tickers)
+
+    def record(self, ticker, interval, hist):
+        path = bar_path(self.directory, ticker, interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        bars = hist[bar_columns].copy()
+        if bars.index.tz is not None:
+            bars.index = bars.index.tz_localize(None)
+        bars.index.name = 'ts'
+        if os.path.exists(path):
+            bars = pd.concat([read_bar_file(path), bars])
+            bars = bars[~bars.index.duplicated(keep='last')]
+        bars.sort_index().to_csv(path)
+
+
+def synthetic_bars(ticker, start, end, interval):
+    """
+    Deterministic made-up bars: weekday daily bars, or 9:30-16:00 minute bars for intraday intervals.
+    Prices depend only on the ticker and the bar time, so any two requests agree where they overlap.
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if interval == '1d':
+        index = pd.bdate_range(start.normalize(), end, inclusive='left')
+    else:
+        minutes = int(pd.Timedelta(interval).total_seconds() // 60) or 1
+        days = pd.bdate_range(start.normalize(), end, inclusive='left')
+        index = pd.DatetimeIndex([
+            ts for day in days
+            for ts in pd.date_range(day + pd.Timedelta(hours=9, minutes=30), day + pd.Timedelta(hours=16), freq=f'{minutes}min', inclusive='left')
+        ])
+        index = index[(index >= start) & (index < end)]
+    seed = zlib.crc32(ticker.encode())
+    base = 20 + seed % 480
+    t = index.as_unit('s').asi8 // 60  # minutes since 1970
+    noise = (np.sin(t * 12.9898 + seed) * 43758.5453) % 1 - 0.5
+    close = base * (1 + 0.2 * np.sin(t / 43_200 + seed) + 0.01 * noise)
+    open_ = close * (1 - 0.005 * noise)
+    bars = pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) * 1.003,
+        'Low': np.minimum(open_, close) * 0.997,
+        'Close': close,
+        'Volume': (1_000_000 * (1.5 + noise)).astype(np.int64),
+    }, index=index)
+    bars.index.name = 'ts'
+    return bars
+
+
+class ReplayProvider(PriceProvider):
+    """
+    Recorded bars from directory, or synthetic ones (synthetic=True) for tickers without a recording.
+    Every ticker request waits latency seconds; requests run on a thread pool of max_workers like the live client.
+    """
+
+    def __init__(self, directory, latency=0.0, synthetic=False, max_workers=8):
+        self.directory = directory
+        self.latency = latency
+        self.synthetic = synthetic
+        self.client = MarketDataClient(max_workers=max_workers, rate=1_000_000, burst=1_000_000, retries=0)
+        self.files = {}  # (ticker, interval) -> bars read from disk
+
+    def load(self, ticker, interval):
+        key = (ticker, interval)
+        if key not in self.files:
+            path = bar_path(self.directory, ticker, interval)
+            self.files[key] = read_bar_file(path) if os.path.exists(path) else None
+        return self.files[key]
+
+    def bars(self, tickers, start, end, interval):
+        def request(ticker):
+            if self.latency:
+                time.sleep(self.latency)
+            recorded = self.load(ticker, interval)
+            if recorded is not None:
+                return in_range(recorded, start, end)
+            if self.synthetic:
+                return synthetic_bars(ticker, start, end, interval)
+            raise LookupError(f"No recorded {interval} bars for {ticker} in {self.directory}")
+        return self.client.fetch(tickers, request)
+
+
+def get_provider():
+    """
+    Provider picked by PRICE_PROVIDER: 'yfinance' (default), 'replay' or 'record'.
+    PRICE_REPLAY_DIR (default price_replay), PRICE_REPLAY_LATENCY (seconds per request) and
+    PRICE_REPLAY_SYNTHETIC=1 configure replay; record saves what yfinance returns to PRICE_REPLAY_DIR.
+    """
+    name = os.environ.get('PRICE_PROVIDER', 'yfinance')
+    directory = os.environ.get('PRICE_REPLAY_DIR', 'price_replay')
+    if name == 'yfinance':
+        return YFinanceProvider()
+    if name == 'record':
+        return RecordingProvider(YFinanceProvider(), directory)
+    if name == 'replay':
+        return ReplayProvider(
+            directory,
+            latency=float(os.environ.get('PRICE_REPLAY_LATENCY', 0)),
+            synthetic=os.environ.get('PRICE_REPLAY_SYNTHETIC', '0') == '1',
+        )
+    raise ValueError(f"Unknown PRICE_PROVIDER '{name}', choose from yfinance, replay, record")
+
+
+provider = get_provider()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record daily and intraday bars from yfinance for offline replay")
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--days', type=int, default=365, help="days of daily bars")
+    parser.add_argument('--intraday-days', type=int, default=5, help="days of 1 minute bars (Yahoo keeps about a week)")
+    parser.add_argument('--dir', default=os.environ.get('PRICE_REPLAY_DIR', 'price_replay'))
+    args = parser.parse_args()
+
+    recorder = RecordingProvider(YFinanceProvider(), args.dir)
+    end = pd.Timestamp.now(tz='US/Eastern').normalize().tz_localize(None) + timedelta(days=1)
+    for name, (data, errors) in {
+        'daily': recorder.daily_bars(args.tickers, end - timedelta(days=args.days), end),
+        'intraday': recorder.intraday_bars(args.tickers, end - timedelta(days=args.intraday_days), end),
+    }.items():
+        print(f"Recorded {name} bars for {len(data)} tickers to {args.dir}" + (f", failed: {errors}" if errors else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Price write functions: writing fetched prices back to the finance database
+
+Kept apart from dashboard_functions.py so headless scripts (update_stock_price.py) don't import plotly.
+"""
+
+import time
+import pandas as pd
+from sqlalchemy import text
+
+
+def bulk_update_prices(engine, current_prices):
+    """
+    Write {ticker: price} to stocks.current_price in one transaction and a fixed number of round trips:
+    all prices go into a temporary staging table in one batched insert, then one UPDATE ... JOIN applies them.
+    Tickers without a price (NaN) are left alone. Returns (rows updated, seconds).
+    """
+    start = time.perf_counter()
+    prices = [
+        {"ticker": ticker_symbol, "price": float(price)}
+        for ticker_symbol, price in dict(current_prices).items()
+        if pd.notna(price)
+    ]
+    if not prices:
+        return 0, time.perf_counter() - start
+    
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TEMPORARY TABLE IF NOT EXISTS price_staging (
+                ticker VARCHAR(20) PRIMARY KEY,
+                price DECIMAL(18, 4) NOT NULL
+            )
+        """))
+        conn.execute(text("DELETE FROM price_staging"))
+        # executemany: pymysql sends the whole list as one multi-row INSERT
+        conn.execute(text("INSERT INTO price_staging (ticker, price) VALUES (:ticker, :price)"), prices)
+        result = conn.execute(text("""
+            UPDATE stocks s
+            JOIN price_staging ps ON s.ticker = ps.ticker
+            SET s.current_price = ps.price
+        """))
+        rows = result.rowcount
+        conn.execute(text("DROP TEMPORARY TABLE price_staging"))
+    
+    return rows, time.perf_counter() - start
@@ -1,10 +1,11 @@
 
 import pandas as pd
-import yfinance as yf
 import sqlalchemy
 from sqlalchemy import create_engine
-from datetime import datetime, timedelta
+from datetime import timedelta
 import logging
+from price_history_functions import get_history
+from price_provider_functions import provider
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -62,81 +63,53 @@ def insert_positions_safely(df, engine):
             pass
         raise
 
-def get_opening_prices(df):
+def get_opening_prices(df, engine):
     """
-    Enhanced version that fetches opening prices more efficiently
+    Opening price of every position on the day it was opened: the next trading day's open when
+    date_opened is not a trading day, the previous trading day's when there is no later one.
+    All tickers' bars over the union date range come from one price_history request (one batched
+    download for whatever isn't stored yet) and are matched to the positions with as-of joins.
     """
     df = df.copy()  # Avoid modifying original dataframe
     df['price_open'] = None
+    if df.empty:
+        return df
     
-    # Group by ticker to minimize API calls
-    ticker_groups = df.groupby('ticker')
+    positions = pd.DataFrame({
+        'row': range(len(df)),
+        'ticker': df['ticker'].to_numpy(),
+        'date': pd.to_datetime(df['date_opened']).dt.normalize().astype('datetime64[ns]').to_numpy(),
+    }).sort_values('date')
     
-    for ticker, group in ticker_groups:
-        try:
-            # Get the date range we need for this ticker
-            dates = pd.to_datetime(group['date_opened'])
-            min_date = dates.min()
-            max_date = dates.max()
-            
-            # Add buffer days for weekends/holidays
-            start_date = min_date - timedelta(days=7)
-            end_date = max_date + timedelta(days=7)
-            
-            logger.info(f"Fetching data for {ticker} from {start_date.date()} to {end_date.date()}")
-            
-            # Get historical data for the entire range at once
-            stock = yf.Ticker(ticker)
-            hist = stock.history(start=start_date, end=end_date)
-            
-            if hist.empty:
-                logger.warning(f"No historical data found for {ticker}")
-                continue
-            
-            # For each position of this ticker, find the opening price
-            for idx in group.index:
-                position_date = pd.to_datetime(df.at[idx, 'date_opened'])
-                opening_price = find_opening_price_for_date(hist, position_date, ticker)
-                
-                if opening_price is not None:
-                    df.at[idx, 'price_open'] = round(opening_price, 4)
-                else:
-                    logger.warning(f"Could not find opening price for {ticker} on {position_date.date()}")
-                    
-        except Exception as e:
-            logger.error(f"Error processing {ticker}: {e}")
+    # Add buffer days for weekends/holidays
+    start_date = positions['date'].min() - timedelta(days=7)
+    end_date = positions['date'].max() + timedelta(days=7)
+    tickers = positions['ticker'].unique().tolist()
+    logger.info(f"Fetching data for {len(tickers)} tickers from {start_date.date()} to {end_date.date()}")
     
-    return df
-
-def find_opening_price_for_date(hist_data, target_date, ticker):
-    """
-    Find the best opening price for a given date from historical data
-    """
     try:
-        target_date_str = target_date.strftime('%Y-%m-%d')
-        
-        # First try: exact date match
-        if target_date_str in hist_data.index.strftime('%Y-%m-%d'):
-            exact_match = hist_data[hist_data.index.strftime('%Y-%m-%d') == target_date_str]
-            return exact_match['Open'].iloc[0]
-        
-        # Second try: find the next available trading day
-        future_data = hist_data[hist_data.index.date >= target_date.date()]
-        if not future_data.empty:
-            logger.info(f"Using next available trading day for {ticker} (requested: {target_date_str}, used: {future_data.index[0].strftime('%Y-%m-%d')})")
-            return future_data['Open'].iloc[0]
-        
-        # Third try: use the last available day before target date
-        past_data = hist_data[hist_data.index.date < target_date.date()]
-        if not past_data.empty:
-            logger.info(f"Using previous trading day for {ticker} (requested: {target_date_str}, used: {past_data.index[-1].strftime('%Y-%m-%d')})")
-            return past_data['Open'].iloc[-1]
-        
-        return None
-        
+        bars = get_history(engine, tickers, start_date, end_date)
     except Exception as e:
-        logger.error(f"Error finding opening price for {ticker} on {target_date}: {e}")
-        return None
+        logger.error(f"Error fetching historical data: {e}")
+        return df
+    
+    bars = bars.dropna(subset=['Open']).assign(date=lambda b: b['ts'].dt.normalize().astype('datetime64[ns]'))[['ticker', 'date', 'Open']]
+    bars = bars.sort_values('date')
+    missing = sorted(set(tickers) - set(bars['ticker']))
+    if missing:
+        logger.warning(f"No historical data found for {missing}")
+    
+    # first try: the trading day itself or the next one, then: the last trading day before it
+    matched = pd.merge_asof(positions, bars, on='date', by='ticker', direction='forward')
+    previous = pd.merge_asof(positions, bars, on='date', by='ticker', direction='backward')
+    used_previous = matched['Open'].isna() & previous['Open'].notna()
+    if used_previous.any():
+        logger.info(f"Using previous trading day for {int(used_previous.sum())} positions with no later trading day")
+    matched['Open'] = matched['Open'].fillna(previous['Open'])
+    
+    prices = matched.set_index('row')['Open'].sort_index().round(4)
+    df['price_open'] = prices.astype(object).where(prices.notna(), None).to_numpy()
+    return df
 
 ## MAIN WORKFLOW ##
 def main():
@@ -160,11 +133,9 @@ def main():
         logger.info(f"Fetching current prices for {len(tickers)} unique tickers")
         
         try:
-            data = yf.download(tickers, period="1d", progress=False)
-            if len(tickers) == 1:
-                current_prices = {tickers[0]: data['Close'].iloc[-1]}
-            else:
-                current_prices = data['Close'].iloc[-1].to_dict()
+            current_prices, errors = provider.latest_quotes(tickers)
+            for ticker, error in errors.items():
+                logger.warning(f"Could not fetch current price for {ticker}: {error}")
             
             stock_table_df['current_price'] = stock_table_df['ticker'].map(current_prices)
         except Exception as e:
@@ -199,7 +170,7 @@ def main():
         all_positions_df = new_stock[['account_id', 'ticker', 'quantity', 'date_opened']].copy()
         
         # Get opening prices for all positions
-        all_positions_df = get_opening_prices(all_positions_df)
+        all_positions_df = get_opening_prices(all_positions_df, engine)
         
         # Check for failed price fetches
         failed_prices = all_positions_df[all_positions_df['price_open'].isna()]